@@ -1,11 +1,17 @@
+import os
 import cv2
 import numpy as np
+from zones import Lane, ZoneConfig, load_zones, save_zones
 
 # Global variables
 polygon_points = []
+lanes = []
 
 # Read your video file
 video_path = r"C:\Users\rkssp\Desktop\virtual envi\road\road\cars_-_1900 (720p).mp4"
+zones_path = 'zones.json'
+frame_size = (1920, 1080)
+colors = [(0, 0, 255), (0, 255, 255), (255, 0, 0), (0, 255, 0), (255, 0, 255), (255, 255, 0)]
 cap = cv2.VideoCapture(video_path)
 
 
@@ -17,36 +23,68 @@ def mouse_callback(event, x, y, flags, param):
         print(f"Point Added: (X: {x}, Y: {y})")
 
 
-while True:
-    # Capture the first frame
-    ret, frame = cap.read()
+def finish_lane():
+    # The first two points of a lane are its counting line
+    global polygon_points
+    if len(polygon_points) < 3:
+        print("A lane needs at least 3 points.")
+        return
+    default_name = chr(ord('A') + len(lanes))
+    name = input(f"Lane name [{default_name}]: ").strip() or default_name
+    lanes.append(Lane(name, polygon_points, color=colors[len(lanes) % len(colors)]))
+    print(f"Lane {name} saved with {len(polygon_points)} points.")
+    polygon_points = []
+
+
+# Create the window and set the mouse callback once
+cv2.namedWindow('Frame')
+cv2.setMouseCallback('Frame', mouse_callback)
 
+print("Click to add points, 'n' to finish a lane, 'u' to undo a point, space for the next frame, "
+      "'Esc' to save and exit.")
+
+ret, frame = cap.read()
+while True:
     # Check if the frame is not empty
     if not ret:
         print("Error: No frame captured.")
         break
 
-    frame = cv2.resize(frame, (1920, 1080))
+    display = cv2.resize(frame, frame_size)
 
-    # Create a window and set the mouse callback
-    cv2.namedWindow('Frame')
-    cv2.setMouseCallback('Frame', mouse_callback)
-
-    # Draw the polygon on the frame
+    # Draw the finished lanes and the polygon in progress on the frame
+    for lane in lanes:
+        cv2.polylines(display, [lane.polygon], isClosed=True, color=lane.color, thickness=2)
+        cv2.putText(display, lane.name, tuple(int(v) for v in lane.polygon[0]), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                    lane.color, 2)
     if len(polygon_points) > 1:
-        cv2.polylines(frame, [np.array(polygon_points)], isClosed=False, color=(0, 255, 0), thickness=2)
+        cv2.polylines(display, [np.array(polygon_points)], isClosed=False, color=(0, 255, 0), thickness=2)
 
-    cv2.imshow('Frame', frame)
+    cv2.imshow('Frame', display)
 
-    # Press 'Esc' to exit
-    key = cv2.waitKey(0)
+    key = cv2.waitKey(20) & 0xFF
     if key == 27:
         break
+    elif key == ord('n'):
+        finish_lane()
+    elif key == ord('u') and polygon_points:
+        polygon_points.pop()
+    elif key == ord(' '):
+        ret, frame = cap.read()
 
 cv2.destroyAllWindows()
 cap.release()
 
-# Print the polygon points
-print("Polygon Points:")
-for point in polygon_points:
-    print(f"X: {point[0]}, Y: {point[1]}")
+if len(polygon_points) >= 3:
+    finish_lane()
+
+# Print the polygon points and save the lanes to the zone file
+for lane in lanes:
+    print(f"Lane {lane.name} Polygon Points:")
+    for point in lane.polygon:
+        print(f"X: {point[0]}, Y: {point[1]}")
+if lanes:
+    # keep the ground reference points of an existing zone file, they are measured on site
+    ground = load_zones(zones_path).ground if os.path.exists(zones_path) else None
+    save_zones(zones_path, ZoneConfig(lanes, frame_size, centroid_offset=(0, -40), ground=ground))
+    print(f"Saved {len(lanes)} lanes to {zones_path}")
@@ -1,89 +1,120 @@
+import time
 import cv2
-import cvzone
-import math
-import numpy as np
 from ultralytics import YOLO
-from sort import *
+from checkpoint import CheckpointWriter, load_checkpoint
+from pipeline import Pipeline, STOP
+from lane_counter import LaneCounter, load_classnames, read_batches
+from zones import load_zones
+from lane_aggregator import LaneAggregator
+from overlay import OverlayCompositor, RateLimiter
+from lane_metrics import LaneMetrics
 
 video_path = r'C:\Users\rkssp\Desktop\virtual envi\road\road\cars_-_1900 (720p).mp4'
+zones_path = 'zones.json'
 cap = cv2.VideoCapture(video_path)
 model = YOLO('yolov8n.pt')
-
-classnames = []
-with open('classes.txt', 'r') as f:
-    classnames = f.read().splitlines()
-
-road_zoneA = np.array([[308, 789], [711, 807], [694, 492], [415, 492], [309, 790]], np.int32)
-road_zoneB = np.array([[727, 797], [1123, 812], [1001, 516], [741, 525], [730, 795]], np.int32)
-road_zoneC = np.array([[1116, 701], [1533, 581], [1236, 367], [1009, 442], [1122, 698]], np.int32)
-
-zoneA_Line = np.array([road_zoneA[0],road_zoneA[1]]).reshape(-1)
-zoneB_Line = np.array([road_zoneB[0],road_zoneB[1]]).reshape(-1)
-zoneC_Line = np.array([road_zoneC[0],road_zoneC[1]]).reshape(-1)
-
-tracker = Sort()
-zoneAcounter = []
-zoneBcounter = []
-zoneCcounter = []
-
-while True:
-    ret, frame = cap.read()
-    frame = cv2.resize(frame, (1920,1080))
-    results = model(frame)
-    current_detections = np.empty([0,5])
-
-    for info in results:
-        parameters = info.boxes
-        for box in parameters:
-            x1, y1, x2, y2 = box.xyxy[0]
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-            w, h = x2 - x1, y2 - y1
-            confidence = box.conf[0]
-            class_detect = box.cls[0]
-            class_detect = int(class_detect)
-            class_detect = classnames[class_detect]
-            conf = math.ceil(confidence * 100)
-            cvzone.putTextRect(frame, f'{class_detect}', [x1 + 8, y1 - 12], thickness=2, scale=1)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-            if class_detect == 'car' or class_detect == 'truck' or class_detect == 'bus'\
-                    and conf > 60:
-                detections = np.array([x1,y1,x2,y2,conf])
-                current_detections = np.vstack([current_detections,detections])
-
-    cv2.polylines(frame,[road_zoneA], isClosed=False, color=(0, 0, 255), thickness=8)
-    cv2.polylines(frame, [road_zoneB], isClosed=False, color=(0, 255, 255), thickness=8)
-    cv2.polylines(frame, [road_zoneC], isClosed=False, color=(255,0, 0), thickness=8)
-
-    track_results = tracker.update(current_detections)
-    for result in track_results:
-        x1,y1,x2,y2,id = result
-        x1,y1,x2,y2,id = int(x1),int(y1),int(x2),int(y2),int(id)
-        w, h = x2 - x1, y2 - y1
-        cx, cy = x1 + w // 2, y1 + h // 2 -40
-
-
-        if zoneA_Line[0] < cx < zoneA_Line[2] and zoneA_Line[1] - 20 < cy < zoneA_Line[1] + 20:
-            if zoneAcounter.count(id) == 0:
-                zoneAcounter.append(id)
-
-        if zoneB_Line[0] < cx < zoneB_Line[2] and zoneB_Line[1] - 20 < cy < zoneB_Line[1] + 20:
-            if zoneBcounter.count(id) == 0:
-                zoneBcounter.append(id)
-
-        if zoneC_Line[0] < cx < zoneC_Line[2] and zoneC_Line[1] - 20 < cy < zoneC_Line[1] + 20:
-            if zoneCcounter.count(id) == 0:
-                zoneCcounter.append(id)
-
-        cv2.circle(frame,(970,90),15,(0,0,255),-1)
-        cv2.circle(frame,(970,130),15,(0,255,255),-1)
-        cv2.circle(frame,(970,170),15,(255,0,0),-1)
-        cvzone.putTextRect(frame, f'LANE A Vehicles ={len(zoneAcounter)}', [1000, 99], thickness=4, scale=2.3, border=2)
-        cvzone.putTextRect(frame, f'LANE B Vehicles ={len(zoneBcounter)}', [1000, 140], thickness=4, scale=2.3, border=2)
-        cvzone.putTextRect(frame, f'LANE C Vehicles ={len(zoneCcounter)}', [1000, 180], thickness=4, scale=2.3, border=2)
+zones = load_zones(zones_path)
+classnames = load_classnames('classes.txt')
+
+# the detector runs on native frames (or at inference_size, e.g. 640) in batches of
+# inference_batch frames; boxes are then scaled into the zone file's frame_size the lanes are drawn in.
+# With roi_inference, only crops covering the lanes and the vehicles around their counting lines
+# (at most roi_max_tiles, padded by roi_padding pixels) are sent to the detector, skipping sky,
+# buildings and the opposite carriageway. The detector runs every
+# 1 to 5 frames (adapted to scene motion and to tracks near a counting line); tracks are moved
+# on by the Kalman prediction in between. Detection and tracking share a stage so that the frames
+# to detect are chosen from the latest tracks; a stride change still waits for the end of the
+# current batch (up to inference_batch - 1 frames)
+inference_size = None
+inference_batch = 4
+roi_inference = False
+roi_max_tiles = 2
+roi_padding = 32
+lanes = LaneCounter(zones, classnames, (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    vehicle_names=('car', 'truck', 'bus'), min_conf=60, roi_inference=roi_inference,
+                    roi_max_tiles=roi_max_tiles, roi_padding=roi_padding, min_stride=1, max_stride=5)
+to_zone = lanes.to_zone
+
+# resume tracks and counts after a restart so vehicles already in the zones keep their IDs
+checkpoint_path = 'lane_counter_checkpoint.npz'
+checkpoint_interval = 150  # frames
+state, counted = load_checkpoint(checkpoint_path)
+if state is not None:
+    lanes.tracker.restore(state)
+    if 'lane_counts' in counted and len(counted['lane_counts']) == len(zones.lanes):
+        lanes.counter.restore(counted)
+checkpoint = CheckpointWriter(checkpoint_path, interval=checkpoint_interval)
+
+# per-lane, per-class counts in 1 and 15 minute buckets, written to SQLite in the background;
+# frame times are video time counted from video_start (UNIX seconds)
+aggregator = LaneAggregator(zones.names, lanes.vehicle_names, 'lane_counts.sqlite', bucket_seconds=(60, 900))
+video_fps = cap.get(cv2.CAP_PROP_FPS) or 30.
+video_start = time.time()
+
+# per-lane speed, headway and flow, when the zone file has ground reference points
+metrics = LaneMetrics(zones, video_fps) if zones.ground is not None else None
+
+# stage queues: 'block' processes every frame of a recording, 'drop_oldest' keeps a live feed current
+queue_size = 4
+backpressure = 'block'
+
+# lanes and legend are pre-rendered once; frames are shown at most display_fps times per second
+# (None shows every frame) and display = False skips rendering altogether
+display = True
+display_fps = 30
+overlay = OverlayCompositor(zones, classnames)
+display_rate = RateLimiter(display_fps)
+
+
+def track(item):
+    lanes.track(item)
+    aggregator.add(video_start + item['number'] / video_fps, item['crossed_lanes'], item['crossed_vehicles'])
+    if item['number'] % checkpoint_interval == 0:
+        checkpoint.save(lanes.tracker, **lanes.counter.state())
+    return item
+
+
+def detect_and_track(batch):
+    return [track(item) for item in lanes.detect(model, batch, inference_size)]
+
+
+def render(item):
+    if not display_rate.ready():
+        return None
+    frame = item['frame']
+    if not to_zone.identity:
+        frame = cv2.resize(frame, zones.frame_size)
+    if len(item['tracks']):
+        overlay.draw(frame, item['boxes'], item['classes'], item['counts'], item['queues'])
+    else:
+        overlay.draw(frame, item['boxes'], item['classes'])
 
     cv2.imshow('frame', frame)
-    cv2.waitKey(1)
-
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        return STOP
+
+
+stages = [('tracking', detect_and_track)]
+if metrics is not None:
+    stages.append(('metrics', metrics.process))
+if display:
+    stages.append(('render', render))
+pipeline = Pipeline(read_batches(cap, inference_batch), stages,
+                    maxsize=queue_size, policy=backpressure)
+pipeline.run()
+for stage, counters in pipeline.stats().items():
+    print(f"{stage:>10}: {counters['processed']} items, {counters['fps']:.1f} items/s, "
+          f"{counters['busy_ms']:.1f} ms/item, {counters['dropped']} dropped")
+if display:
+    print(f"Displayed {display_rate.passed} of {lanes.stride.frames} frames")
+print(f"Detector ran on {lanes.stride.detector_runs} of {lanes.stride.frames} frames")
+if metrics is not None:
+    for name, lane in metrics.summary().items():
+        print(f"LANE {name}: speed {lane['speed_kmh'] or 0:.1f} km/h, headway {lane['headway_s'] or 0:.1f} s, "
+              f"flow {lane['flow_vph'] or 0:.0f} veh/h")
+
+checkpoint.close()
+aggregator.close()
 cap.release()
-cv2.destroyAllWindows()
+if display:
+    cv2.destroyAllWindows()
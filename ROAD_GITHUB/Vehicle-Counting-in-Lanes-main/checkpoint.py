@@ -0,0 +1,105 @@
+"""
+Periodic, non-blocking checkpoints of a Sort tracker.
+
+A CheckpointWriter takes a Sort.snapshot on the frame thread (a copy of a few small arrays) and
+hands it to a background thread that writes it as an uncompressed .npz, via a temporary file
+and an atomic rename so a crash never leaves a half-written checkpoint. If the writer is still
+busy, the pending snapshot is replaced by the newer one instead of queueing up.
+
+    writer = CheckpointWriter('tracker.npz', interval=300)
+    state, extra = load_checkpoint('tracker.npz')
+    if state is not None:
+        tracker.restore(state)
+    ...
+    writer.maybe_save(tracker, frame_number, counted=np.array(counted_ids))
+    ...
+    writer.close()
+"""
+import os
+import threading
+
+import numpy as np
+
+EXTRA_PREFIX = 'extra_'
+
+
+def save_checkpoint(path, state, extra=None):
+  """
+  Writes a Sort.snapshot dict, plus optional extra arrays, to path atomically.
+  """
+  arrays = dict(state)
+  for name, value in (extra or {}).items():
+    arrays[EXTRA_PREFIX + name] = np.asarray(value)
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    np.savez(f, **arrays)
+  os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+  """
+  Returns (state, extra) from a checkpoint written by save_checkpoint, or (None, {}) if path
+  does not exist. state can be passed to Sort.restore.
+  """
+  if not os.path.exists(path):
+    return None, {}
+  with np.load(path) as data:
+    state, extra = {}, {}
+    for name in data.files:
+      if name.startswith(EXTRA_PREFIX):
+        extra[name[len(EXTRA_PREFIX):]] = data[name]
+      else:
+        state[name] = data[name]
+  return state, extra
+
+
+class CheckpointWriter(object):
+  """
+  Saves tracker snapshots every `interval` frames from a background thread.
+  """
+  def __init__(self, path, interval=300):
+    self.path = path
+    self.interval = interval
+    self.saved = 0
+    self._pending = None
+    self._closed = False
+    self._cond = threading.Condition()
+    self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+    self._thread.start()
+
+  def maybe_save(self, tracker, frame_number, **extra):
+    """
+    Queues a checkpoint when frame_number is a multiple of the interval.
+    """
+    if(frame_number % self.interval == 0):
+      self.save(tracker, **extra)
+
+  def save(self, tracker, **extra):
+    """
+    Queues a checkpoint of tracker and the extra arrays; never waits for the disk.
+    """
+    snapshot = (tracker.snapshot(), dict((name, np.array(value)) for name, value in extra.items()))
+    with self._cond:
+      self._pending = snapshot
+      self._cond.notify()
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while self._pending is None and not self._closed:
+          self._cond.wait()
+        if self._pending is None:
+          return
+        state, extra = self._pending
+        self._pending = None
+      save_checkpoint(self.path, state, extra)
+      self.saved += 1
+
+  def close(self):
+    """
+    Writes any pending checkpoint and stops the background thread.
+    """
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join()
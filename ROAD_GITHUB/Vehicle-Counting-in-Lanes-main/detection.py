@@ -0,0 +1,280 @@
+"""
+Detector helpers for the lane counter.
+
+Zones and counting lines are defined in a fixed zone coordinate space (1920x1080, the size the
+zones were drawn at). Instead of resizing every frame to that size before inference, frames are
+sent to the detector at their native resolution, several at a time, and the resulting boxes are
+mapped into zone space with a precomputed ScaleTransform.
+"""
+import numpy as np
+
+from sort import overlapping_pairs, iou_pairs
+
+ZONE_SIZE = (1920, 1080)
+
+
+class ScaleTransform(object):
+  """
+  Maps boxes and points between frame pixels and the zone coordinate space.
+  """
+  def __init__(self, frame_size, zone_size=ZONE_SIZE):
+    """
+    frame_size and zone_size are (width, height).
+    """
+    self.frame_size = tuple(int(v) for v in frame_size)
+    self.zone_size = tuple(int(v) for v in zone_size)
+    sx = float(zone_size[0]) / frame_size[0]
+    sy = float(zone_size[1]) / frame_size[1]
+    self.scale = np.array([sx, sy, sx, sy])
+
+  @property
+  def identity(self):
+    return self.frame_size == self.zone_size
+
+  def to_zone(self, boxes):
+    """
+    Returns N x 4 [x1,y1,x2,y2] frame boxes in zone coordinates.
+    """
+    return boxes[:, :4] * self.scale
+
+  def to_frame(self, boxes):
+    """
+    Returns N x 4 [x1,y1,x2,y2] zone boxes in frame coordinates.
+    """
+    return boxes[:, :4] / self.scale
+
+
+def detect_batch(model, frames, imgsz=None):
+  """
+  Runs an ultralytics model on a list of frames in one call and returns one Results per frame.
+
+  imgsz is the inference size passed to the model; None lets it letterbox the native frame.
+  """
+  kwargs = {'verbose': False}
+  if imgsz is not None:
+    kwargs['imgsz'] = imgsz
+  return model(frames, **kwargs)
+
+
+def class_id_mask(classnames, selected):
+  """
+  Returns a boolean array over class IDs that is True for the class names in selected.
+  """
+  return np.array([name in selected for name in classnames], dtype=bool)
+
+
+def boxes_arrays(boxes):
+  """
+  Returns (xyxy N x 4, conf N, class IDs N) NumPy arrays of ultralytics Boxes.
+  """
+  return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+
+def boxes_to_detections(boxes, to_zone, class_mask, min_conf=60):
+  """
+  Converts one frame's ultralytics Boxes into the Sort input array in a single pass.
+
+  boxes may also be an (xyxy, conf, class IDs) tuple of NumPy arrays in frame pixels, as
+  returned by boxes_arrays or detect_tiles. The box, confidence and class tensors are moved to
+  NumPy once; boxes are scaled into zone space and truncated to whole pixels, confidences become
+  ceil(100 * conf) percentages, and rows are kept where class_mask[class ID] is set and the
+  confidence exceeds min_conf.
+  Returns (detections N x 5 [x1,y1,x2,y2,conf], their class IDs N, all boxes M x 4 int,
+  all class IDs M).
+  """
+  if len(boxes[0] if isinstance(boxes, tuple) else boxes) == 0:
+    return np.empty((0, 5)), np.empty(0, dtype=int), np.empty((0, 4), dtype=int), np.empty(0, dtype=int)
+  xyxy, conf, cls = boxes if isinstance(boxes, tuple) else boxes_arrays(boxes)
+  xyxy = to_zone.to_zone(xyxy).astype(int)
+  conf = np.ceil(conf * 100)
+  keep = class_mask[cls] & (conf > min_conf)
+  return np.column_stack((xyxy[keep], conf[keep])).astype(float), cls[keep], xyxy, cls
+
+
+def roi_tiles(zones, to_zone, max_tiles=2, padding=32, vehicle_size=200):
+  """
+  Returns up to max_tiles [x1,y1,x2,y2] frame-pixel crops that together cover every lane.
+
+  Starts from one bounding rectangle per lane, covering the lane polygon and its counting line
+  grown on every side by the centroid offset plus vehicle_size (zone pixels, about the largest
+  vehicle's height), so a vehicle is still seen whole when its offset centroid crosses the line
+  in either direction. The rectangles are converted to frame pixels, grown by padding and
+  clipped to the frame, and the pair whose union adds the least area is merged greedily until
+  at most max_tiles remain and no two tiles overlap.
+  """
+  w, h = to_zone.frame_size
+  margin = np.abs(zones.centroid_offset) + vehicle_size
+  rects = []
+  for lane in zones.lanes:
+    x1, y1 = np.minimum(lane.polygon.min(axis=0), lane.line.min(axis=0) - margin)
+    x2, y2 = np.maximum(lane.polygon.max(axis=0), lane.line.max(axis=0) + margin)
+    rects.append(to_zone.to_frame(np.array([[x1, y1, x2, y2]], float))[0])
+  rects = [np.clip(r + [-padding, -padding, padding, padding], 0, [w, h, w, h]) for r in rects]
+
+  def area(r):
+    return max(r[2] - r[0], 0) * max(r[3] - r[1], 0)
+
+  def union(a, b):
+    return np.concatenate((np.minimum(a[:2], b[:2]), np.maximum(a[2:], b[2:])))
+
+  def overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+  while len(rects) > 1:
+    pairs = [(area(union(rects[i], rects[j])) - area(rects[i]) - area(rects[j]), i, j)
+             for i in range(len(rects)) for j in range(i + 1, len(rects))]
+    must = len(rects) > max_tiles or any(overlap(rects[i], rects[j]) for _, i, j in pairs)
+    if not must:
+      break
+    _, i, j = min(pairs, key=lambda p: (not overlap(rects[p[1]], rects[p[2]]), p[0]))
+    rects[i] = union(rects[i], rects[j])
+    del rects[j]
+  return np.array(rects).round().astype(int).reshape(-1, 4)
+
+
+def suppress_seam_duplicates(xyxy, conf, tile, iou_threshold=0.5, containment=0.8):
+  """
+  Returns a mask keeping one box of each duplicate pair found by different tiles.
+
+  A pair from different tiles is a duplicate when its IOU exceeds iou_threshold or when most
+  (containment) of the smaller box lies inside the other, as happens to a vehicle cut at a
+  tile edge; the box with the lower confidence is dropped.
+  """
+  keep = np.ones(len(xyxy), dtype=bool)
+  i, j = overlapping_pairs(xyxy, xyxy)
+  pair = (i < j) & (tile[i] != tile[j])
+  i, j = i[pair], j[pair]
+  if len(i) == 0:
+    return keep
+  a, b = xyxy[i], xyxy[j]
+  inter = (np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])) * (np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]))
+  smaller = np.minimum((a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]))
+  duplicate = (iou_pairs(a, b) > iou_threshold) | (inter > containment * smaller)
+  keep[np.where(conf[i] < conf[j], i, j)[duplicate]] = False
+  return keep
+
+
+def detect_tiles(model, frames, tiles, imgsz=None):
+  """
+  Runs the model only on the tile crops of each frame, all in one batched call.
+
+  Boxes are shifted back to frame pixels and duplicates at tile seams removed. Returns one
+  (xyxy, conf, class IDs) tuple per frame, accepted by boxes_to_detections.
+  """
+  crops = [frame[y1:y2, x1:x2] for frame in frames for x1, y1, x2, y2 in tiles]
+  results = detect_batch(model, crops, imgsz)
+  out = []
+  for f in range(len(frames)):
+    parts = [boxes_arrays(results[f * len(tiles) + t].boxes) for t in range(len(tiles))]
+    xyxy = np.concatenate([p[0] + np.tile(tiles[t, :2], 2) for t, p in enumerate(parts)]).reshape(-1, 4)
+    conf = np.concatenate([p[1] for p in parts])
+    cls = np.concatenate([p[2] for p in parts])
+    tile = np.repeat(np.arange(len(tiles)), [len(p[1]) for p in parts])
+    keep = suppress_seam_duplicates(xyxy, conf, tile)
+    out.append((xyxy[keep], conf[keep], cls[keep]))
+  return out
+
+
+def track_labels(tracks, detections, labels, default=-1):
+  """
+  Returns, for every Sort.update row, the label of the detection it overlaps most (default
+  where it overlaps none). Tracks are only reported on frames they were matched, so this
+  recovers e.g. the class of each track without threading it through the tracker.
+  """
+  out = np.full(len(tracks), default, dtype=np.asarray(labels).dtype if len(labels) else int)
+  trk_idx, det_idx = overlapping_pairs(np.asarray(tracks)[:, :4], np.asarray(detections)[:, :4])
+  if len(trk_idx):
+    iou = iou_pairs(tracks[trk_idx, :4], detections[det_idx, :4])
+    order = np.lexsort((iou, trk_idx))
+    last = np.r_[trk_idx[order][1:] != trk_idx[order][:-1], True]
+    out[trk_idx[order][last]] = np.asarray(labels)[det_idx[order][last]]
+  return out
+
+
+class AdaptiveStride(object):
+  """
+  Decides on which frames to run the detector; the frames in between are left to Sort.propagate.
+
+  The stride k (frames per detector run) is the largest value that keeps the fastest track's
+  predicted movement over k frames under max_shift pixels, clipped to [min_stride, max_stride],
+  and drops to min_stride while any track is within line_margin pixels (plus what it can move
+  in one stride) of a counting line. k falls immediately and rises by one step per decision.
+
+  due and update must be called from one thread in frame order, update right after tracking
+  each frame. When the frames of a batch are decided together before tracking them, a stride
+  change takes effect up to batch size - 1 frames late.
+  """
+  def __init__(self, min_stride=1, max_stride=5, max_shift=12.0, line_margin=30.0):
+    self.min_stride = min_stride
+    self.max_stride = max_stride
+    self.max_shift = max_shift
+    self.line_margin = line_margin
+    self.stride = min_stride
+    self.last_detected = None
+    self.frames = 0
+    self.detector_runs = 0
+
+  def due(self, frame_number):
+    """
+    Returns True if the detector should run on frame_number and records the decision.
+    """
+    self.frames += 1
+    if self.last_detected is None or frame_number - self.last_detected >= self.stride:
+      self.last_detected = frame_number
+      self.detector_runs += 1
+      return True
+    return False
+
+  def update(self, speeds, line_distances):
+    """
+    Adapts the stride to per-track speeds (pixels per frame, NaN if unknown) and distances to
+    the nearest counting line; returns the new stride.
+    """
+    speeds = np.asarray(speeds)
+    speeds = speeds[np.isfinite(speeds)]
+    fastest = speeds.max() if len(speeds) else 0.
+    if len(line_distances) and np.min(line_distances) < self.line_margin + fastest * self.stride:
+      target = self.min_stride
+    elif fastest > 0:
+      target = int(np.clip(self.max_shift // fastest, self.min_stride, self.max_stride))
+    else:
+      target = self.max_stride
+    self.stride = target if target < self.stride else min(self.stride + 1, target)
+    return self.stride
+
+
+class TrackLabels(object):
+  """
+  Remembers a label (e.g. vehicle class) per reported track between detector runs.
+
+  Only the tracks of the latest update are kept, so memory follows the live track count.
+  """
+  def __init__(self, default=-1):
+    self.default = default
+    self.ids = np.empty(0, dtype=np.int64)
+    self.labels = np.empty(0, dtype=int)
+
+  def update(self, tracks, detections, labels):
+    """
+    Labels Sort.update rows from the detections they overlap (see track_labels), keeping a
+    track's previous label when it overlaps none, and returns the labels.
+    """
+    current = track_labels(tracks, detections, labels, self.default)
+    missing = current == self.default
+    current[missing] = self.lookup(tracks[missing])
+    ids = np.asarray(tracks)[:, 4].astype(np.int64)
+    order = np.argsort(ids)
+    self.ids, self.labels = ids[order], current[order]
+    return current
+
+  def lookup(self, tracks):
+    """
+    Returns the remembered labels of Sort.update style rows (default for unknown tracks).
+    """
+    ids = np.asarray(tracks).reshape(-1, 5)[:, 4].astype(np.int64)
+    out = np.full(len(ids), self.default, dtype=self.labels.dtype)
+    if len(self.ids):
+      pos = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+      found = self.ids[pos] == ids
+      out[found] = self.labels[pos[found]]
+    return out
@@ -0,0 +1,101 @@
+"""
+Time-bucketed per-lane, per-class vehicle counts persisted to SQLite.
+
+Counts accumulate in fixed-size lane x class arrays, one per bucket length (1 and 15 minutes by
+default). When a bucket closes its counts are handed to a background thread, which writes all
+pending rows in one transaction every flush_interval seconds, so the frame loop never touches
+the disk and memory does not grow with run time. Rows are upserted additively:
+
+    lane_counts(bucket_start, bucket_seconds, lane, class, count)
+
+so a bucket flushed partially at shutdown is completed, not overwritten, if the run resumes
+within it. bucket_start is a UNIX timestamp aligned to the bucket length.
+"""
+import queue
+import sqlite3
+import threading
+
+import numpy as np
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS lane_counts (
+  bucket_start INTEGER NOT NULL,
+  bucket_seconds INTEGER NOT NULL,
+  lane TEXT NOT NULL,
+  class TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  PRIMARY KEY (bucket_start, bucket_seconds, lane, class))'''
+UPSERT = '''INSERT INTO lane_counts (bucket_start, bucket_seconds, lane, class, count) VALUES (?, ?, ?, ?, ?)
+  ON CONFLICT (bucket_start, bucket_seconds, lane, class) DO UPDATE SET count = count + excluded.count'''
+
+
+class LaneAggregator(object):
+  """
+  Accumulates lane crossings into time buckets and persists closed buckets in the background.
+  """
+  def __init__(self, lane_names, class_names, db_path='lane_counts.sqlite', bucket_seconds=(60, 900),
+               flush_interval=5.0):
+    self.lane_names = list(lane_names)
+    self.class_names = list(class_names)
+    self.db_path = db_path
+    self.bucket_seconds = tuple(int(s) for s in bucket_seconds)
+    self.flush_interval = flush_interval
+    self.bucket_start = [None] * len(self.bucket_seconds)
+    self.counts = np.zeros((len(self.bucket_seconds), len(self.lane_names), len(self.class_names)), dtype=np.int64)
+    self.rows_written = 0
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._run, name='lane-aggregator', daemon=True)
+    self._thread.start()
+
+  def add(self, timestamp, lanes, classes):
+    """
+    Counts one crossing per (lane index, class index) pair observed at timestamp (seconds).
+    """
+    for i, size in enumerate(self.bucket_seconds):
+      start = int(timestamp // size) * size
+      if self.bucket_start[i] != start:
+        self._close(i)
+        self.bucket_start[i] = start
+    if len(lanes):
+      for i in range(len(self.bucket_seconds)):
+        np.add.at(self.counts[i], (lanes, classes), 1)
+
+  def _close(self, i):
+    if self.bucket_start[i] is not None:
+      self._queue.put((self.bucket_start[i], self.bucket_seconds[i], self.counts[i].copy()))
+    self.counts[i] = 0
+
+  def _rows(self, start, size, counts):
+    return [(start, size, lane, name, int(counts[l, c]))
+            for l, lane in enumerate(self.lane_names) for c, name in enumerate(self.class_names)]
+
+  def _run(self):
+    connection = sqlite3.connect(self.db_path)
+    connection.execute(SCHEMA)
+    connection.commit()
+    done = False
+    while not done:
+      pending = []
+      try:
+        pending.append(self._queue.get(timeout=self.flush_interval))
+        while True:
+          pending.append(self._queue.get_nowait())
+      except queue.Empty:
+        pass
+      if None in pending:
+        done = True
+        pending = [bucket for bucket in pending if bucket is not None]
+      if pending:
+        rows = [row for bucket in pending for row in self._rows(*bucket)]
+        with connection:
+          connection.executemany(UPSERT, rows)
+        self.rows_written += len(rows)
+    connection.close()
+
+  def close(self):
+    """
+    Persists the open buckets as they stand and stops the writer thread.
+    """
+    for i in range(len(self.bucket_seconds)):
+      self._close(i)
+    self._queue.put(None)
+    self._thread.join()
@@ -0,0 +1,287 @@
+"""
+Lane counting of recorded videos, one process per video.
+
+LaneCounter holds the per-video state of the lane counter (tracker, line-crossing counter,
+adaptive detector stride and vehicle classes) so that the interactive script and the batch
+runner share it. Run as a script, a list or glob of videos is spread over a process pool; each
+worker loads the YOLO model once, reuses it for every video it is given and pins its thread
+count so that the workers together do not oversubscribe the cores. Every video is counted with
+its own zone file (<video>.zones.json next to the video, or --zones) and its counts, plus speed
+metrics when the zone file has ground points (see lane_metrics.py), are written to
+output_dir/<video>.json:
+
+    $ python lane_counter.py "recordings/*.mp4" --workers 4 --threads 2 --output_dir counts
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from sort import Sort, KalmanBoxTracker
+from pipeline import Pipeline
+from detection import (ScaleTransform, detect_batch, detect_tiles, roi_tiles, class_id_mask, boxes_to_detections,
+                       AdaptiveStride, TrackLabels)
+from zones import load_zones, LineCrossingCounter, track_centroids, distance_to_lines
+from lane_metrics import LaneMetrics
+
+VEHICLE_NAMES = ('car', 'truck', 'bus')
+
+
+def load_classnames(path='classes.txt'):
+  with open(path, 'r') as f:
+    return f.read().splitlines()
+
+
+def zones_for(video_path, default='zones.json'):
+  """
+  Returns the zone file of a video: <video>.zones.json if it exists, otherwise default.
+  """
+  path = os.path.splitext(video_path)[0] + '.zones.json'
+  return path if os.path.exists(path) else default
+
+
+class LaneCounter(object):
+  """
+  Detection, tracking and line counting state of one video.
+
+  Items are dicts with the frame 'number' (from 1) and the 'frame' image; detect() adds the
+  detections of a batch of items and track() adds the tracks and the lane counts of one item.
+  Both run in the same thread, each batch detected right before its items are tracked (see
+  process), so the detector stride follows the tracks up to the previous batch.
+  """
+  def __init__(self, zones, classnames, frame_size, vehicle_names=VEHICLE_NAMES, min_conf=60,
+               roi_inference=False, roi_max_tiles=2, roi_padding=32, min_stride=1, max_stride=5):
+    self.zones = zones
+    self.min_conf = min_conf
+    self.to_zone = ScaleTransform(frame_size, zones.frame_size)
+    self.vehicle_names = tuple(vehicle_names)
+    self.vehicle_classes = class_id_mask(classnames, self.vehicle_names)
+    self.vehicle_index = np.full(len(classnames), -1)
+    self.vehicle_index[[classnames.index(name) for name in self.vehicle_names]] = np.arange(len(self.vehicle_names))
+    self.tiles = roi_tiles(zones, self.to_zone, max_tiles=roi_max_tiles, padding=roi_padding) if roi_inference else None
+    self.tracker = Sort()
+    self.counter = LineCrossingCounter(zones)
+    self.labels = TrackLabels()
+    self.stride = AdaptiveStride(min_stride=min_stride, max_stride=max_stride)
+    # per lane, per vehicle class counts of crossings whose class is known
+    self.class_counts = np.zeros((len(zones.lanes), len(self.vehicle_names)), dtype=np.int64)
+
+  def detect(self, model, batch, imgsz=None):
+    """
+    Runs the model on the items of batch that are due for detection, in one call.
+
+    Items skipped by the adaptive stride get detections None and no boxes. The frames are
+    chosen from the stride left by the last tracked item, so the whole batch must be tracked
+    before the next one is detected.
+    """
+    due = [item for item in batch if self.stride.due(item['number'])]
+    for item in batch:
+      item['detections'] = None
+      item['boxes'] = np.empty((0, 4), dtype=int)
+      item['classes'] = np.empty(0, dtype=int)
+    if due:
+      frames = [item['frame'] for item in due]
+      if self.tiles is not None:
+        results = detect_tiles(model, frames, self.tiles, imgsz)
+      else:
+        results = [info.boxes for info in detect_batch(model, frames, imgsz)]
+      for item, boxes in zip(due, results):
+        item['detections'], item['vehicles'], item['boxes'], item['classes'] = boxes_to_detections(
+          boxes, self.to_zone, self.vehicle_classes, min_conf=self.min_conf)
+    return batch
+
+  def track(self, item):
+    """
+    Updates (or, without detections, propagates) the tracks and counts line crossings.
+
+    Adds 'tracks', 'counts' and 'queues' (per lane), 'lane_crossings' (lane index of every
+    crossing) and 'crossed_lanes' and 'crossed_vehicles' (lane and vehicle class index of each
+    crossing of a known class).
+    """
+    if item['detections'] is None:
+      tracks = self.tracker.propagate()
+      counts = self.counter.update(tracks)
+      vehicles = self.labels.lookup(tracks[self.counter.crossed_rows])
+    else:
+      tracks = self.tracker.update(item['detections'])
+      counts = self.counter.update(tracks)
+      vehicles = self.labels.update(tracks, item['detections'], self.vehicle_index[item['vehicles']])
+      vehicles = vehicles[self.counter.crossed_rows]
+    self.stride.update(self.counter.speed, distance_to_lines(track_centroids(tracks, self.zones.centroid_offset),
+                                                             self.zones.lines).min(axis=1, initial=np.inf))
+    known = vehicles >= 0
+    item['lane_crossings'] = self.counter.crossed_lanes
+    item['crossed_lanes'] = self.counter.crossed_lanes[known]
+    item['crossed_vehicles'] = vehicles[known]
+    np.add.at(self.class_counts, (item['crossed_lanes'], item['crossed_vehicles']), 1)
+    item['tracks'] = tracks
+    item['counts'] = counts.tolist()
+    item['queues'] = self.counter.queue.tolist()
+    return item
+
+  def process(self, model, batch, imgsz=None):
+    """
+    Detects and then tracks a batch; returns its items as a list (one pipeline item each).
+    """
+    return [self.track(item) for item in self.detect(model, batch, imgsz)]
+
+  def results(self):
+    """
+    Returns {lane name: {'total': count, <vehicle class>: count, ...}}.
+    """
+    return dict((name, dict([('total', int(total))] + [(v, int(c)) for v, c in zip(self.vehicle_names, row)]))
+                for name, total, row in zip(self.zones.names, self.counter.counts, self.class_counts))
+
+
+def read_batches(cap, batch_size):
+  """
+  Yields lists of up to batch_size {'number', 'frame'} items read from a cv2.VideoCapture.
+  """
+  number = 0
+  batch = []
+  while True:
+    ret, frame = cap.read()
+    if not ret:
+      break
+    number += 1
+    batch.append({'number': number, 'frame': frame})
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def count_video(model, video_path, zones_path, classnames, batch_size=4, imgsz=None, queue_size=4, **counter_args):
+  """
+  Counts the vehicles crossing each lane of one video without display.
+
+  Decoding, detection with tracking and (when the zone file has ground reference points) speed
+  metrics run as pipeline stages. Track IDs restart at 1 for every video so results do not
+  depend on which worker, or in which order, videos are processed.
+  Returns a JSON-ready dict with the per-lane counts, metrics and timing.
+  """
+  import cv2
+  KalmanBoxTracker.count = 0
+  cap = cv2.VideoCapture(video_path)
+  if not cap.isOpened():
+    raise IOError('Cannot open video %s' % video_path)
+  start = time.perf_counter()
+  zones = load_zones(zones_path)
+  counter = LaneCounter(zones, classnames,
+                        (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), **counter_args)
+  stages = [('tracking', lambda batch: counter.process(model, batch, imgsz))]
+  metrics = LaneMetrics(zones, cap.get(cv2.CAP_PROP_FPS) or 30.) if zones.ground is not None else None
+  if metrics is not None:
+    stages.append(('metrics', metrics.process))
+  pipeline = Pipeline(read_batches(cap, batch_size), stages, maxsize=queue_size, policy='block')
+  pipeline.run()
+  cap.release()
+  seconds = time.perf_counter() - start
+  frames = counter.stride.frames
+  return {'video': video_path, 'zones': zones_path, 'frames': frames, 'detector_runs': counter.stride.detector_runs,
+          'seconds': seconds, 'fps': frames / seconds if seconds > 0 else 0.0, 'lanes': counter.results(),
+          'metrics': metrics.summary() if metrics is not None else None}
+
+
+_worker = {}
+
+
+THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def thread_env(threads):
+  """
+  Sets the OpenMP/BLAS thread variables for processes started afterwards.
+
+  They are read when numpy (and its BLAS) is first imported, which in this module happens at
+  import time, so they only reach new worker processes and not the current one.
+  """
+  for var in THREAD_VARS:
+    os.environ[var] = str(threads)
+
+
+def pin_threads(threads):
+  """
+  Limits OpenCV, torch and, if threadpoolctl is installed, the already loaded BLAS/OpenMP
+  libraries to threads threads in this process.
+  """
+  try:
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(limits=threads)
+  except ImportError:
+    pass
+  import cv2
+  cv2.setNumThreads(threads)
+  try:
+    import torch
+    torch.set_num_threads(threads)
+  except ImportError:
+    pass
+
+
+def _init_worker(weights, threads, classes_path):
+  if threads:
+    pin_threads(threads)
+  from ultralytics import YOLO
+  _worker['model'] = YOLO(weights)
+  _worker['classnames'] = load_classnames(classes_path)
+
+
+def _count_video_job(job):
+  video_path, zones_path, output_dir, kwargs = job
+  result = count_video(_worker['model'], video_path, zones_path, _worker['classnames'], **kwargs)
+  name = os.path.splitext(os.path.basename(video_path))[0]
+  with open(os.path.join(output_dir, name + '.json'), 'w') as f:
+    json.dump(result, f, indent=2)
+  print('%s: %d frames in %.1fs (%.1f FPS) %s' % (name, result['frames'], result['seconds'], result['fps'],
+        ' '.join('%s=%d' % (lane, c['total']) for lane, c in sorted(result['lanes'].items()))))
+  return result
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='Batch lane counter')
+    parser.add_argument("videos", help="Video files or glob patterns.", type=str, nargs='+')
+    parser.add_argument("--zones", help="Zone file for videos without a <video>.zones.json.", type=str, default='zones.json')
+    parser.add_argument("--weights", help="YOLO weights loaded once per worker.", type=str, default='yolov8n.pt')
+    parser.add_argument("--classes", help="Class names file.", type=str, default='classes.txt')
+    parser.add_argument("--workers", help="Number of processes counting videos in parallel.", type=int, default=1)
+    parser.add_argument("--threads", help="Threads per worker (0 leaves the libraries' defaults).", type=int, default=0)
+    parser.add_argument("--batch", help="Frames per detector call.", type=int, default=4)
+    parser.add_argument("--imgsz", help="Detector inference size (default: native frame size).", type=int, default=None)
+    parser.add_argument("--roi", help="Run the detector on lane crops instead of whole frames.", action='store_true')
+    parser.add_argument("--output_dir", help="Directory for per-video count files.", type=str, default='counts')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  videos = []
+  for pattern in args.videos:
+    videos.extend(sorted(glob.glob(pattern)) or [pattern])
+  if not os.path.exists(args.output_dir):
+    os.makedirs(args.output_dir)
+  kwargs = {'batch_size': args.batch, 'imgsz': args.imgsz, 'roi_inference': args.roi}
+  jobs = [(video, zones_for(video, args.zones), args.output_dir, kwargs) for video in videos]
+  threads = args.threads or (max(1, (os.cpu_count() or 1) // args.workers) if args.workers > 1 else 0)
+  if threads:
+    # inherited by the workers, which (when spawned) import numpy only after this
+    thread_env(threads)
+  start = time.perf_counter()
+  if(args.workers <= 1):
+    _init_worker(args.weights, threads, args.classes)
+    results = [_count_video_job(job) for job in jobs]
+  else:
+    from multiprocessing import Pool
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.weights, threads, args.classes)) as pool:
+      results = pool.map(_count_video_job, jobs, chunksize=1)
+  seconds = time.perf_counter() - start
+  frames = sum(result['frames'] for result in results)
+  print("Counted %d videos, %d frames in %.1f seconds or %.1f FPS" % (len(results), frames, seconds, frames / seconds if seconds > 0 else 0.0))
@@ -0,0 +1,139 @@
+"""
+Per-lane speed, headway and flow of the lane counter.
+
+Track centroids are mapped to the road plane (metres) with the homography of the zone file's
+ground reference points, all tracks of a frame in one transform. Every track keeps its last
+`window` road positions in a shift register, and its speed is the distance between the oldest
+and newest position over the time between them. Per-lane figures are group-bys over the lane
+label of each track (np.bincount), and line crossings are kept in a per-lane ring of crossing
+times from which headway and flow are read, so no step loops over vehicles in Python.
+"""
+import numpy as np
+
+from zones import lane_of, match_tracks, merge_tracks, track_centroids, to_ground
+
+
+class LaneMetrics(object):
+  """
+  Mean speed of the tracks in each lane, and headway and flow of the vehicles crossing each
+  lane's counting line.
+
+  update() returns, per lane, 'speed_kmh' (NaN without moving tracks), 'headway_s' (mean time
+  between the crossings kept, NaN with fewer than two), 'flow_vph' (crossings in the last
+  flow_window seconds, per hour), plus 'track_speed_kmh' for each input row (NaN for tracks
+  seen once).
+  """
+  def __init__(self, zones, fps, window=5, expire=30, flow_window=60.0, max_crossings=256):
+    """
+    zones must have ground reference points; fps converts frame numbers to seconds.
+    """
+    self.homography = zones.homography
+    if self.homography is None:
+      raise ValueError("speed metrics need the 'ground' reference points in the zone file")
+    self.zones = zones
+    self.fps = float(fps)
+    self.window = window
+    self.expire = expire
+    self.flow_window = flow_window
+    self.labels = zones.label_map()
+    n = len(zones.lanes)
+    self.start = None
+    self.ids = np.empty(0, dtype=np.int64)
+    self.positions = np.empty((0, window, 2))
+    self.times = np.empty((0, window))
+    self.seen = np.empty(0, dtype=np.int64)
+    self.crossings = np.full((n, max_crossings), np.nan)
+    self.head = np.zeros(n, dtype=np.int64)
+    # whole-run totals for summary()
+    self.speed_sum = np.zeros(n)
+    self.speed_samples = np.zeros(n, dtype=np.int64)
+    self.crossed = np.zeros(n, dtype=np.int64)
+    self.first_crossing = np.full(n, np.nan)
+    self.last_crossing = np.full(n, np.nan)
+    self.now = 0.0
+
+  def update(self, tracks, frame, crossed_lanes=()):
+    """
+    Feeds one frame of Sort.update output with its frame number and the lane indices of the
+    line crossings counted in it, and returns the per-lane metrics.
+    """
+    self.now = now = frame / self.fps
+    if self.start is None:
+      self.start = now
+    tracks = np.asarray(tracks, float).reshape(-1, 5)
+    ids = tracks[:, 4].astype(np.int64)
+    points = track_centroids(tracks, self.zones.centroid_offset)
+    ground = to_ground(self.homography, points)
+
+    pos, known = match_tracks(self.ids, ids)
+    positions = np.full((len(ids), self.window, 2), np.nan)
+    times = np.full((len(ids), self.window), np.nan)
+    positions[known, :-1] = self.positions[pos[known], 1:]
+    times[known, :-1] = self.times[pos[known], 1:]
+    positions[:, -1] = ground
+    times[:, -1] = now
+
+    # speed over the oldest position still in the window
+    oldest = np.argmax(~np.isnan(times), axis=1)
+    rows = np.arange(len(ids))
+    dt = now - times[rows, oldest]
+    speed = np.full(len(ids), np.nan)
+    moving = dt > 0
+    speed[moving] = 3.6 * np.hypot(*(ground[moving] - positions[rows[moving], oldest[moving]]).T) / dt[moving]
+
+    n = len(self.zones.lanes)
+    lane = lane_of(self.labels, points)
+    valid = (lane > 0) & moving
+    samples = np.bincount(lane[valid], minlength=n + 1)[1:]
+    sums = np.bincount(lane[valid], weights=speed[valid], minlength=n + 1)[1:]
+    lane_speed = np.full(n, np.nan)
+    np.divide(sums, samples, out=lane_speed, where=samples > 0)
+    self.speed_sum += sums
+    self.speed_samples += samples
+
+    self._add_crossings(np.asarray(crossed_lanes, dtype=np.intp), now)
+    kept = ~np.isnan(self.crossings)
+    count = kept.sum(axis=1)
+    newest = np.where(kept, self.crossings, -np.inf).max(axis=1)
+    first = np.where(kept, self.crossings, np.inf).min(axis=1)
+    headway = np.full(n, np.nan)
+    np.divide(newest - first, count - 1, out=headway, where=count > 1)
+    recent = (kept & (self.crossings > now - self.flow_window)).sum(axis=1)
+    flow = recent * 3600. / max(min(self.flow_window, now - self.start), 1. / self.fps)
+
+    self.ids, self.seen, (self.positions, self.times) = merge_tracks(
+      frame, self.expire, ids, (positions, times), self.ids, (self.positions, self.times), self.seen, pos, known)
+    return {'speed_kmh': lane_speed, 'headway_s': headway, 'flow_vph': flow, 'track_speed_kmh': speed}
+
+  def _add_crossings(self, lanes, now):
+    if len(lanes) == 0:
+      return
+    lanes = np.sort(lanes)
+    rank = np.arange(len(lanes)) - np.searchsorted(lanes, lanes)
+    self.crossings[lanes, (self.head[lanes] + rank) % self.crossings.shape[1]] = now
+    added = np.bincount(lanes, minlength=len(self.head))
+    self.head += added
+    self.crossed += added
+    self.first_crossing[lanes] = np.where(np.isnan(self.first_crossing[lanes]), now, self.first_crossing[lanes])
+    self.last_crossing[lanes] = now
+
+  def process(self, item):
+    """
+    Pipeline stage: adds 'metrics' to an item carrying 'tracks', 'number' and 'lane_crossings'.
+    """
+    item['metrics'] = self.update(item['tracks'], item['number'], item['lane_crossings'])
+    return item
+
+  def summary(self):
+    """
+    Returns {lane name: {'speed_kmh', 'headway_s', 'flow_vph'}} over everything seen so far
+    (None where undefined).
+    """
+    duration = self.now - self.start if self.start is not None else 0.
+    result = {}
+    for i, name in enumerate(self.zones.names):
+      speed = float(self.speed_sum[i] / self.speed_samples[i]) if self.speed_samples[i] else None
+      headway = float((self.last_crossing[i] - self.first_crossing[i]) / (self.crossed[i] - 1)) if self.crossed[i] > 1 else None
+      flow = float(self.crossed[i] * 3600. / duration) if duration > 0 else None
+      result[name] = {'speed_kmh': speed, 'headway_s': headway, 'flow_vph': flow}
+    return result
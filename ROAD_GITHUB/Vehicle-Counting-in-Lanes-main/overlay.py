@@ -0,0 +1,138 @@
+"""
+Display layer of the lane counter.
+
+Lane polylines and the legend markers never change, so they are drawn once into a static layer
+with a mask; the legend text is drawn into its own layer that is redrawn only when a count or
+queue length changes. Each displayed frame then only gets a masked copy of the layers (limited
+to the bounding box of what was drawn) plus the per-detection boxes and labels.
+Rendering is rate limited with a RateLimiter so display can run slower than processing.
+"""
+import time
+
+import cv2
+import cvzone
+import numpy as np
+
+
+class Layer(object):
+  """
+  An image drawn once and composited onto frames where something was drawn.
+  """
+  def __init__(self, size, opacity=1.0):
+    """
+    size is (width, height) of the frames the layer is composited onto.
+    """
+    self.image = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    self.opacity = opacity
+    self.roi = None
+    self.mask = None
+
+  def clear(self):
+    if self.roi is not None:
+      self.image[self.roi] = 0
+
+  def seal(self, roi=None):
+    """
+    Computes the mask of drawn (non-black) pixels and its bounding box after drawing, looking
+    only inside roi (a pair of row and column slices) when given.
+    """
+    image = self.image if roi is None else self.image[roi]
+    mask = (image[..., 0] | image[..., 1] | image[..., 2]).astype(bool).view(np.uint8)
+    x, y, w, h = cv2.boundingRect(mask)
+    if not (w and h):
+      self.roi, self.mask = None, None
+      return
+    self.mask = mask[y:y + h, x:x + w].copy()
+    if roi is not None:
+      x, y = x + (roi[1].start or 0), y + (roi[0].start or 0)
+    self.roi = (slice(y, y + h), slice(x, x + w))
+
+  def composite(self, frame):
+    """
+    Copies (or, with opacity below 1, blends) the drawn pixels of the layer onto frame in place.
+    """
+    if self.roi is None:
+      return frame
+    target, image = frame[self.roi], self.image[self.roi]
+    if self.opacity < 1.0:
+      image = cv2.addWeighted(image, self.opacity, target, 1.0 - self.opacity, 0)
+    cv2.copyTo(image, self.mask, target)
+    return frame
+
+
+class OverlayCompositor(object):
+  """
+  Draws the lanes, the per-lane legend and the detections of the lane counter onto frames.
+  """
+  def __init__(self, zones, classnames, size=None, legend_origin=(970, 90), legend_step=40, opacity=1.0):
+    """
+    size is the (width, height) of the frames drawn on, by default the zone file's frame_size.
+    """
+    self.zones = zones
+    self.classnames = classnames
+    self.size = tuple(size or zones.frame_size)
+    self.legend_origin = legend_origin
+    self.legend_step = legend_step
+    self.static = Layer(self.size, opacity)
+    for lane in zones.lanes:
+      cv2.polylines(self.static.image, [lane.polygon], isClosed=False, color=lane.color, thickness=8)
+    self.static.seal()
+    self.markers = Layer(self.size)
+    x, y = legend_origin
+    for i, lane in enumerate(zones.lanes):
+      cv2.circle(self.markers.image, (x, y + legend_step * i), 15, lane.color, -1)
+    self.markers.seal()
+    self.legend = Layer(self.size)
+    self._legend_key = None
+    # the legend text stays right of the markers, within legend_step rows per lane
+    self._legend_roi = (slice(max(0, y - 2 * legend_step), y + legend_step * (len(zones.lanes) + 2)), slice(x, None))
+
+  def _update_legend(self, counts, queues):
+    key = (tuple(counts), tuple(queues))
+    if key == self._legend_key:
+      return
+    self._legend_key = key
+    self.legend.clear()
+    x, y = self.legend_origin
+    for i, (lane, count, queue) in enumerate(zip(self.zones.lanes, counts, queues)):
+      cvzone.putTextRect(self.legend.image, f'LANE {lane.name} Vehicles ={count} Queue ={queue}',
+                         [x + 30, y + 9 + self.legend_step * i], thickness=4, scale=2.3, border=2)
+    self.legend.seal(self._legend_roi)
+
+  def draw(self, frame, boxes, classes, counts=None, queues=None):
+    """
+    Draws onto frame (already of the compositor's size) in place and returns it.
+
+    boxes are N x 4 int [x1,y1,x2,y2] with class IDs classes; the legend is shown when counts
+    and queues are given.
+    """
+    for (x1, y1, x2, y2), class_id in zip(boxes.tolist(), classes.tolist()):
+      cvzone.putTextRect(frame, f'{self.classnames[class_id]}', [x1 + 8, y1 - 12], thickness=2, scale=1)
+      cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    self.static.composite(frame)
+    if counts is not None:
+      self._update_legend(counts, queues)
+      self.markers.composite(frame)
+      self.legend.composite(frame)
+    return frame
+
+
+class RateLimiter(object):
+  """
+  Lets through at most max_fps events per second (None lets every event through).
+  """
+  def __init__(self, max_fps=None, clock=time.perf_counter):
+    self.interval = 1.0 / max_fps if max_fps else 0.0
+    self.clock = clock
+    self._next = None
+    self.passed = 0
+    self.skipped = 0
+
+  def ready(self):
+    now = self.clock()
+    if self._next is not None and now < self._next:
+      self.skipped += 1
+      return False
+    self._next = now + self.interval if self._next is None or now - self._next > self.interval else self._next + self.interval
+    self.passed += 1
+    return True
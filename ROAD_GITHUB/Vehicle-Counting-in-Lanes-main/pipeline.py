@@ -0,0 +1,209 @@
+"""
+Threaded stage pipeline for the lane counter.
+
+A source (e.g. video decoding) and a chain of stages each run in their own thread, connected by
+bounded queues, so decoding, inference, tracking and display overlap instead of running one
+after another. The last stage runs in the calling thread, which keeps cv2.imshow on the main
+thread. Each queue either blocks the producer when full ('block', for recorded video where
+every frame counts) or drops the oldest waiting item ('drop_oldest', for live feeds where
+latency matters more).
+
+    pipeline = Pipeline(read_frames(cap), [('inference', detect), ('tracking', track), ('render', show)],
+                        maxsize=4, policy='drop_oldest')
+    pipeline.run()
+    print(pipeline.stats())
+
+A stage function receives one item and returns the item for the next stage; returning None
+skips the item, returning a list forwards each of its elements as a separate item (so a source
+can emit batches that a batched stage splits up again) and returning STOP ends the pipeline.
+An exception raised by the source or any stage also ends the pipeline and is re-raised by run.
+"""
+import collections
+import threading
+import time
+
+STOP = object()
+POLICIES = ('block', 'drop_oldest')
+
+
+class BoundedQueue(object):
+  """
+  Thread-safe FIFO of at most maxsize items with a selectable full-queue policy.
+  """
+  def __init__(self, maxsize=8, policy='block'):
+    if policy not in POLICIES:
+      raise ValueError("policy must be one of %s, got %r" % (', '.join(POLICIES), policy))
+    self.maxsize = maxsize
+    self.policy = policy
+    self.dropped = 0
+    self._items = collections.deque()
+    self._cond = threading.Condition()
+    self._closed = False
+
+  def __len__(self):
+    return len(self._items)
+
+  def put(self, item):
+    """
+    Appends item, blocking or dropping the oldest item when full. STOP is always accepted.
+    """
+    with self._cond:
+      if item is not STOP:
+        if self.policy == 'block':
+          while len(self._items) >= self.maxsize and not self._closed:
+            self._cond.wait()
+        else:
+          while len(self._items) >= self.maxsize:
+            self._items.popleft()
+            self.dropped += 1
+      if self._closed:
+        return
+      self._items.append(item)
+      self._cond.notify_all()
+
+  def get(self):
+    """
+    Removes and returns the oldest item, waiting for one; returns STOP once closed.
+    """
+    with self._cond:
+      while not self._items and not self._closed:
+        self._cond.wait()
+      if self._closed:
+        return STOP
+      item = self._items.popleft()
+      self._cond.notify_all()
+      return item
+
+  def close(self):
+    """
+    Discards waiting items and releases every blocked producer and consumer.
+    """
+    with self._cond:
+      self._closed = True
+      self._items.clear()
+      self._cond.notify_all()
+
+
+class StageStats(object):
+  """
+  Throughput counters of one stage.
+  """
+  def __init__(self, name):
+    self.name = name
+    self.processed = 0
+    self.busy = 0.0
+    self.started = None
+    self.finished = None
+
+  def as_dict(self, queue=None):
+    elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+    return {'processed': self.processed,
+            'fps': self.processed / elapsed if elapsed > 0 else 0.0,
+            'busy_ms': 1000. * self.busy / self.processed if self.processed else 0.0,
+            'queued': len(queue) if queue is not None else 0,
+            'dropped': queue.dropped if queue is not None else 0}
+
+
+class Pipeline(object):
+  """
+  Runs a source iterable and a chain of (name, function) stages connected by bounded queues.
+  """
+  def __init__(self, source, stages, maxsize=8, policy='block', source_name='decode'):
+    self.source = source
+    self.names = [source_name] + [name for name, _ in stages]
+    self.functions = [fn for _, fn in stages]
+    self.queues = [BoundedQueue(maxsize, policy) for _ in stages]
+    self._stats = [StageStats(name) for name in self.names]
+    self._stop = threading.Event()
+    self._error = None
+
+  def _fail(self, error):
+    if self._error is None:
+      self._error = error
+    self.stop()
+
+  def _run_source(self):
+    stats = self._stats[0]
+    stats.started = time.perf_counter()
+    iterator = iter(self.source)
+    while not self._stop.is_set():
+      start = time.perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        break
+      except Exception as error:
+        self._fail(error)
+        break
+      stats.busy += time.perf_counter() - start
+      stats.processed += 1
+      self.queues[0].put(item)
+    stats.finished = time.perf_counter()
+    self.queues[0].put(STOP)
+
+  def _run_stage(self, i):
+    stats = self._stats[i + 1]
+    stats.started = time.perf_counter()
+    fn, queue = self.functions[i], self.queues[i]
+    downstream = self.queues[i + 1] if i + 1 < len(self.queues) else None
+    while True:
+      item = queue.get()
+      if item is STOP:
+        break
+      start = time.perf_counter()
+      try:
+        result = fn(item)
+      except Exception as error:
+        self._fail(error)
+        break
+      stats.busy += time.perf_counter() - start
+      stats.processed += 1
+      if result is STOP:
+        self.stop()
+        break
+      if result is None or downstream is None:
+        continue
+      if isinstance(result, list):
+        for element in result:
+          downstream.put(element)
+      else:
+        downstream.put(result)
+    stats.finished = time.perf_counter()
+    if downstream is not None:
+      downstream.put(STOP)
+
+  def stop(self):
+    """
+    Ends the pipeline early, discarding items still queued.
+    """
+    self._stop.set()
+    for queue in self.queues:
+      queue.close()
+
+  def run(self):
+    """
+    Runs until the source is exhausted or a stage returns STOP; the last stage runs here.
+    Re-raises the first exception of the source or a stage once every thread has ended.
+    """
+    threads = [threading.Thread(target=self._run_source, name=self.names[0], daemon=True)]
+    threads += [threading.Thread(target=self._run_stage, args=(i,), name=self.names[i + 1], daemon=True)
+                for i in range(len(self.functions) - 1)]
+    for thread in threads:
+      thread.start()
+    try:
+      if self.functions:
+        self._run_stage(len(self.functions) - 1)
+    finally:
+      self.stop()
+      for thread in threads:
+        thread.join()
+    if self._error is not None:
+      raise self._error
+
+  def stats(self):
+    """
+    Returns {stage name: counters} with processed items, throughput (fps), mean busy time per
+    item, and the depth and drop count of the stage's input queue.
+    """
+    queues = [None] + self.queues
+    return dict((s.name, s.as_dict(q)) for s, q in zip(self._stats, queues))
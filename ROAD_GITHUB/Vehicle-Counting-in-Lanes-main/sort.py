@@ -12,20 +12,27 @@ from skimage import io
 import glob
 import time
 import argparse
+from collections import deque
 from filterpy.kalman import KalmanFilter
 
 np.random.seed(0)
 
 
+try:
+  import lap
+except ImportError:
+  lap = None
+  from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
 def linear_assignment(cost_matrix):
-  try:
-    import lap
+  if lap is not None:
     _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
     return np.array([[y[i],i] for i in x if i >= 0]) #
-  except ImportError:
-    from scipy.optimize import linear_sum_assignment
-    x, y = linear_sum_assignment(cost_matrix)
-    return np.array(list(zip(x, y)))
+  x, y = linear_sum_assignment(cost_matrix)
+  return np.array(list(zip(x, y)))
 
 
 def iou_batch(bb_test, bb_gt):
@@ -47,6 +54,89 @@ def iou_batch(bb_test, bb_gt):
   return(o)  
 
 
+def iou_pairs(bb_test, bb_gt):
+  """
+  Computes IOU between matching rows of two N x 4 arrays of bboxes in the form [x1,y1,x2,y2]
+  """
+  xx1 = np.maximum(bb_test[:, 0], bb_gt[:, 0])
+  yy1 = np.maximum(bb_test[:, 1], bb_gt[:, 1])
+  xx2 = np.minimum(bb_test[:, 2], bb_gt[:, 2])
+  yy2 = np.minimum(bb_test[:, 3], bb_gt[:, 3])
+  w = np.maximum(0., xx2 - xx1)
+  h = np.maximum(0., yy2 - yy1)
+  wh = w * h
+  return wh / ((bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+    + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1]) - wh)
+
+
+def overlapping_pairs(bb_test, bb_gt, test_groups=None, gt_groups=None):
+  """
+  Finds every (test, gt) pair of bboxes that overlap, without scoring all N x M pairs.
+
+  The gt boxes are sorted by x1 so each test box only visits the gt boxes whose x1 lies in
+  [test x1 - widest gt box, test x2), found with two binary searches; the candidates are then
+  checked for overlap on both axes. With integer test_groups/gt_groups labels only pairs with
+  the same label are returned. Returns two index arrays, ordered by test index.
+  """
+  if(len(bb_test) == 0 or len(bb_gt) == 0):
+    return np.empty(0, dtype=int), np.empty(0, dtype=int)
+  max_w = np.max(bb_gt[:, 2] - bb_gt[:, 0])
+  test_lo, test_hi, gt_x1 = bb_test[:, 0] - max_w, bb_test[:, 2], bb_gt[:, 0]
+  if test_groups is not None:
+    # lay the groups out side by side along x so that one sorted index serves all of them
+    origin = min(bb_test[:, 0].min(), bb_gt[:, 0].min())
+    span = max(bb_test[:, 2].max(), bb_gt[:, 2].max()) - origin + max_w + 2.
+    test_lo = test_lo - origin + test_groups * span
+    test_hi = test_hi - origin + test_groups * span
+    gt_x1 = gt_x1 - origin + gt_groups * span
+  order = np.argsort(gt_x1, kind='stable')
+  x1 = gt_x1[order]
+  lo = np.searchsorted(x1, test_lo - 1., side='left')
+  hi = np.searchsorted(x1, test_hi + 1., side='left')
+  counts = np.maximum(hi - lo, 0)
+  test_idx = np.repeat(np.arange(len(bb_test)), counts)
+  starts = np.cumsum(counts) - counts
+  gt_idx = order[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+  a, b = bb_test[test_idx], bb_gt[gt_idx]
+  overlap = (a[:, 0] < b[:, 2]) & (b[:, 0] < a[:, 2]) & (a[:, 1] < b[:, 3]) & (b[:, 1] < a[:, 3])
+  if test_groups is not None:
+    overlap &= test_groups[test_idx] == gt_groups[gt_idx]
+  return test_idx[overlap], gt_idx[overlap]
+
+
+def sparse_linear_assignment(rows, cols, iou, n_rows, n_cols):
+  """
+  Maximises total IOU over the candidate pairs (rows[k], cols[k]) with score iou[k].
+
+  All other pairs score 0, so the problem splits into the connected components of the candidate
+  graph: components made of a single pair are matched directly and the remaining (crowded) ones
+  are solved as small dense problems with linear_assignment.
+  """
+  if(len(rows) == 0):
+    return np.empty((0,2),dtype=int)
+  graph = coo_matrix((np.ones(len(rows)), (rows, n_rows + cols)), shape=(n_rows + n_cols, n_rows + n_cols))
+  _, labels = connected_components(graph, directed=False)
+  edge_label = labels[rows]
+  edges_per_label = np.bincount(edge_label, minlength=labels.max() + 1)
+  single = edges_per_label[edge_label] == 1
+  matched = [np.stack((rows[single], cols[single]), axis=1)]
+  crowded = ~single
+  if(crowded.any()):
+    r, c, o, l = rows[crowded], cols[crowded], iou[crowded], edge_label[crowded]
+    order = np.argsort(l, kind='stable')
+    r, c, o, l = r[order], c[order], o[order], l[order]
+    bounds = np.flatnonzero(np.diff(l)) + 1
+    for cr, cc, co in zip(np.split(r, bounds), np.split(c, bounds), np.split(o, bounds)):
+      ur, ir = np.unique(cr, return_inverse=True)
+      uc, ic = np.unique(cc, return_inverse=True)
+      cost = np.zeros((len(ur), len(uc)))
+      cost[ir, ic] = -co
+      m = linear_assignment(cost)
+      matched.append(np.stack((ur[m[:, 0]], uc[m[:, 1]]), axis=1))
+  matched = np.concatenate(matched, axis=0).astype(int)
+  return matched[np.argsort(matched[:, 0], kind='stable')]
+
+
 def convert_bbox_to_z(bbox):
   """
   Takes a bounding box in the form [x1,y1,x2,y2] and returns z in the form
@@ -80,6 +170,7 @@ class KalmanBoxTracker(object):
   This class represents the internal state of individual tracked objects observed as bbox.
   """
   count = 0
+  max_history = 64
   def __init__(self,bbox):
     """
     Initialises a tracker using initial bounding box.
@@ -99,7 +190,7 @@ class KalmanBoxTracker(object):
     self.time_since_update = 0
     self.id = KalmanBoxTracker.count
     KalmanBoxTracker.count += 1
-    self.history = []
+    self.history = deque(maxlen=KalmanBoxTracker.max_history)
     self.hits = 0
     self.hit_streak = 0
     self.age = 0
@@ -109,18 +200,21 @@ class KalmanBoxTracker(object):
     Updates the state vector with observed bbox.
     """
     self.time_since_update = 0
-    self.history = []
+    self.history.clear()
     self.hits += 1
     self.hit_streak += 1
     self.kf.update(convert_bbox_to_z(bbox))
 
-  def predict(self):
+  def predict(self, coast=False):
     """
     Advances the state vector and returns the predicted bounding box estimate.
+    With coast=True only the filter moves; age, hit streak and time since update are kept.
     """
     if((self.kf.x[6]+self.kf.x[2])<=0):
       self.kf.x[6] *= 0.0
     self.kf.predict()
+    if(coast):
+      return convert_x_to_bbox(self.kf.x)
     self.age += 1
     if(self.time_since_update>0):
       self.hit_streak = 0
@@ -135,60 +229,300 @@ class KalmanBoxTracker(object):
     return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
+def convert_bboxes_to_z(bboxes):
+  """
+  Vectorised convert_bbox_to_z: takes N boxes [x1,y1,x2,y2] and returns an N x 4 array of [x,y,s,r]
+  """
+  w = bboxes[:, 2] - bboxes[:, 0]
+  h = bboxes[:, 3] - bboxes[:, 1]
+  return np.stack((bboxes[:, 0] + w/2., bboxes[:, 1] + h/2., w * h, w / h), axis=1)
+
+
+def convert_xs_to_bboxes(x):
+  """
+  Vectorised convert_x_to_bbox: takes an N x 7 state array and returns an N x 4 array of [x1,y1,x2,y2]
+  """
+  w = np.sqrt(x[:, 2] * x[:, 3])
+  h = x[:, 2] / w
+  return np.stack((x[:, 0]-w/2., x[:, 1]-h/2., x[:, 0]+w/2., x[:, 1]+h/2.), axis=1)
+
+
+class KalmanBoxBatch(object):
+  """
+  Struct-of-arrays state of many tracked objects observed as bbox.
+
+  Holds the same constant velocity model as KalmanBoxTracker, but every track lives in one row of
+  stacked arrays (means N x 7, covariances N x 7 x 7), so predict and update run as single NumPy
+  operations over all tracks instead of one filterpy call per object.
+  """
+  F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]], dtype=float)
+  H = np.array([[1,0,0,0,0,0,0],[0,1,0,0,0,0,0],[0,0,1,0,0,0,0],[0,0,0,1,0,0,0]], dtype=float)
+  R = np.diag([1., 1., 10., 10.])
+  Q = np.diag([1., 1., 1., 1., .01, .01, .0001])
+  P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+  columns = ('x', 'P', 'id', 'time_since_update', 'hits', 'hit_streak', 'age', 'slot', 'stream')
+
+  def __init__(self):
+    """
+    Initialises an empty batch.
+    """
+    self.x = np.zeros((0, 7))
+    self.P = np.zeros((0, 7, 7))
+    self.id = np.zeros(0, dtype=np.int64)
+    self.time_since_update = np.zeros(0, dtype=np.int64)
+    self.hits = np.zeros(0, dtype=np.int64)
+    self.hit_streak = np.zeros(0, dtype=np.int64)
+    self.age = np.zeros(0, dtype=np.int64)
+    self.slot = np.zeros(0, dtype=np.int64)
+    self.stream = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.x)
+
+  def add(self, bboxes, stream=0):
+    """
+    Starts one track per row of bboxes, drawing IDs from the KalmanBoxTracker counter.
+    stream labels the new tracks (a scalar or one label per box), see MultiSort.
+    """
+    n = len(bboxes)
+    if(n == 0):
+      return
+    x = np.zeros((n, 7))
+    x[:, :4] = convert_bboxes_to_z(bboxes)
+    ids = np.arange(KalmanBoxTracker.count, KalmanBoxTracker.count + n)
+    KalmanBoxTracker.count += n
+    zeros = np.zeros(n, dtype=np.int64)
+    new = {'x': x, 'P': np.broadcast_to(self.P0, (n, 7, 7)), 'id': ids, 'slot': zeros - 1,
+           'stream': np.broadcast_to(np.asarray(stream, dtype=np.int64), (n,))}
+    for name in self.columns:
+      setattr(self, name, np.concatenate((getattr(self, name), new.get(name, zeros))))
+
+  def keep(self, mask):
+    """
+    Drops every track whose entry in the boolean mask is False, preserving the order of the rest.
+    """
+    for name in self.columns:
+      setattr(self, name, getattr(self, name)[mask])
+
+  def predict(self, coast=False):
+    """
+    Advances all state vectors and returns the N x 4 predicted bounding box estimates.
+    With coast=True only the filters move; ages, hit streaks and times since update are kept.
+    """
+    self.x[(self.x[:, 6] + self.x[:, 2]) <= 0, 6] = 0.
+    self.x = self.x @ self.F.T
+    self.P = self.F @ self.P @ self.F.T + self.Q
+    if(coast):
+      return convert_xs_to_bboxes(self.x)
+    self.age += 1
+    self.hit_streak[self.time_since_update > 0] = 0
+    self.time_since_update += 1
+    return convert_xs_to_bboxes(self.x)
+
+  def update(self, idx, bboxes):
+    """
+    Updates the tracks at positions idx with their observed bboxes.
+    """
+    if(len(idx) == 0):
+      return
+    x = self.x[idx]
+    P = self.P[idx]
+    y = convert_bboxes_to_z(bboxes) - x @ self.H.T
+    PHT = P @ self.H.T
+    K = PHT @ np.linalg.inv(self.H @ PHT + self.R)
+    I_KH = np.eye(7) - K @ self.H
+    self.x[idx] = x + (K @ y[:, :, None])[:, :, 0]
+    self.P[idx] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+    self.time_since_update[idx] = 0
+    self.hits[idx] += 1
+    self.hit_streak[idx] += 1
+
+  def get_state(self):
+    """
+    Returns the N x 4 current bounding box estimates.
+    """
+    return convert_xs_to_bboxes(self.x)
+
+
+def dense_assignment(detections, trackers, iou_threshold):
+  """
+  Scores every (detection, tracker) pair and assigns them with linear_assignment, as SORT does.
+  """
+  iou_matrix = iou_batch(detections[:, :4], trackers[:, :4])
+  if(min(iou_matrix.shape) == 0):
+    return np.empty((0,2),dtype=int)
+  a = (iou_matrix > iou_threshold).astype(np.int32)
+  if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+    return np.stack(np.where(a), axis=1)
+  return linear_assignment(-iou_matrix).reshape(-1, 2)
+
+
+def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3, det_groups=None, trk_groups=None):
   """
   Assigns detections to tracked object (both represented as bounding boxes)
 
+  Only overlapping pairs, found with overlapping_pairs, are scored and passed to the assignment;
+  every other pair has IOU 0 and cannot change the matches. Optional integer det_groups and
+  trk_groups (e.g. camera streams) restrict matching to equal labels, with the same result as
+  associating each group on its own.
+
+  A crowded group (not one-to-one above the threshold) with more detections than trackers is
+  still scored with dense_assignment: the detections the dense solver leaves out come first in
+  unmatched_detections, and that order decides the order and IDs of the tracks Sort creates.
+  With iou_threshold <= 0 pairs that do not overlap at all are valid matches too, so every
+  group is scored with dense_assignment.
+
   Returns 3 lists of matches, unmatched_detections and unmatched_trackers
   """
   if(len(trackers)==0):
     return np.empty((0,2),dtype=int), np.arange(len(detections)), np.empty((0,5),dtype=int)
 
-  iou_matrix = iou_batch(detections, trackers)
-
-  if min(iou_matrix.shape) > 0:
-    a = (iou_matrix > iou_threshold).astype(np.int32)
-    if a.sum(1).max() == 1 and a.sum(0).max() == 1:
-        matched_indices = np.stack(np.where(a), axis=1)
-    else:
-      matched_indices = linear_assignment(-iou_matrix)
+  det_idx, trk_idx = overlapping_pairs(detections[:, :4], trackers[:, :4], det_groups, trk_groups)
+  iou = iou_pairs(detections[det_idx, :4], trackers[trk_idx, :4])
+  if det_groups is None:
+    det_groups = np.zeros(len(detections), dtype=int)
+    trk_groups = np.zeros(len(trackers), dtype=int)
+  n_groups = max(det_groups.max(initial=0), trk_groups.max(initial=0)) + 1
+  n_det = np.bincount(det_groups, minlength=n_groups)
+  n_trk = np.bincount(trk_groups, minlength=n_groups)
+
+  # a group whose above-threshold pairs are already one-to-one takes them as they are
+  a = iou > iou_threshold
+  det_hits = np.bincount(det_idx[a], minlength=len(detections))
+  trk_hits = np.bincount(trk_idx[a], minlength=len(trackers))
+  det_max = np.zeros(n_groups, dtype=int)
+  trk_max = np.zeros(n_groups, dtype=int)
+  np.maximum.at(det_max, det_groups, det_hits)
+  np.maximum.at(trk_max, trk_groups, trk_hits)
+  group_fast = (det_max == 1) & (trk_max == 1)
+  if(iou_threshold <= 0):
+    group_fast[:] = False
+    dense = (n_det > 0) & (n_trk > 0)
   else:
-    matched_indices = np.empty(shape=(0,2))
-
-  unmatched_detections = []
-  for d, det in enumerate(detections):
-    if(d not in matched_indices[:,0]):
-      unmatched_detections.append(d)
-  unmatched_trackers = []
-  for t, trk in enumerate(trackers):
-    if(t not in matched_indices[:,1]):
-      unmatched_trackers.append(t)
+    dense = ~group_fast & (n_det > n_trk) & (n_trk > 0)
+  fast = group_fast[det_groups[det_idx]]
+
+  slow = ~fast & ~dense[det_groups[det_idx]] & (iou > 0)
+  assigned = sparse_linear_assignment(det_idx[slow], trk_idx[slow], iou[slow], len(detections), len(trackers))
+  # every detection of these groups gets a tracker from the dense solver, so their low-IOU pairs
+  # count as unassigned
+  assigned = assigned[iou_pairs(detections[assigned[:, 0], :4], trackers[assigned[:, 1], :4]) >= iou_threshold]
+  matched_indices = [np.stack((det_idx[fast & a], trk_idx[fast & a]), axis=1), assigned]
+  for g in np.flatnonzero(dense):
+    d, t = np.flatnonzero(det_groups == g), np.flatnonzero(trk_groups == g)
+    m = dense_assignment(detections[d], trackers[t], iou_threshold)
+    matched_indices.append(np.stack((d[m[:, 0]], t[m[:, 1]]), axis=1))
+  return _filter_matches(detections, trackers, np.concatenate(matched_indices).astype(int), iou_threshold)
+
+
+def _filter_matches(detections, trackers, matched_indices, iou_threshold):
+  """
+  Drops assigned pairs with IOU below iou_threshold and returns matches, unmatched_detections and
+  unmatched_trackers in SORT's order: the indices never assigned in ascending order, then those
+  of the dropped pairs in detection order.
+  """
+  matched_indices = matched_indices[np.argsort(matched_indices[:, 0], kind='stable')]
+  matched_iou = iou_pairs(detections[matched_indices[:, 0], :4], trackers[matched_indices[:, 1], :4])
 
   #filter out matched with low IOU
-  matches = []
-  for m in matched_indices:
-    if(iou_matrix[m[0], m[1]]<iou_threshold):
-      unmatched_detections.append(m[0])
-      unmatched_trackers.append(m[1])
-    else:
-      matches.append(m.reshape(1,2))
-  if(len(matches)==0):
-    matches = np.empty((0,2),dtype=int)
-  else:
-    matches = np.concatenate(matches,axis=0)
+  low = matched_iou < iou_threshold
+  matches, rejected = matched_indices[~low], matched_indices[low]
+  det_unmatched = np.ones(len(detections), dtype=bool)
+  det_unmatched[matched_indices[:, 0]] = False
+  trk_unmatched = np.ones(len(trackers), dtype=bool)
+  trk_unmatched[matched_indices[:, 1]] = False
+
+  return (matches, np.concatenate((np.flatnonzero(det_unmatched), rejected[:, 0])),
+          np.concatenate((np.flatnonzero(trk_unmatched), rejected[:, 1])))
 
-  return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+
+TRACK_BORN, TRACK_CONFIRMED, TRACK_LOST, TRACK_DELETED = range(4)
+EVENT_NAMES = ('born', 'confirmed', 'lost', 'deleted')
+EVENT_DTYPE = np.dtype([('frame', np.int64), ('id', np.int64), ('event', np.int8),
+                        ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32)])
+
+
+class TrackEvents(object):
+  """
+  Preallocated buffer of the track lifecycle events of one frame, see Sort(events=True).
+
+  Each event is an EVENT_DTYPE row: frame, track ID (as reported by Sort.update), event type
+  (TRACK_BORN, TRACK_CONFIRMED, TRACK_LOST or TRACK_DELETED) and the track's box. The buffer
+  doubles when a frame has more events than it holds and is reused every frame, so `array` is a
+  view that is only valid until the next update.
+  """
+  def __init__(self, capacity=256):
+    self._buffer = np.zeros(capacity, dtype=EVENT_DTYPE)
+    self._n = 0
+
+  def __len__(self):
+    return self._n
+
+  def __iter__(self):
+    for row in self.array:
+      yield EVENT_NAMES[row['event']], int(row['id']), row
+
+  @property
+  def array(self):
+    return self._buffer[:self._n]
+
+  def clear(self):
+    self._n = 0
+
+  def append(self, frame, event, ids, boxes):
+    """
+    Adds one event of type event for each track ID in ids with its N x 4 boxes.
+    """
+    n = len(ids)
+    if(n == 0):
+      return
+    while self._n + n > len(self._buffer):
+      self._buffer = np.concatenate((self._buffer, np.zeros(len(self._buffer), dtype=EVENT_DTYPE)))
+    rows = self._buffer[self._n:self._n + n]
+    rows['frame'] = frame
+    rows['id'] = ids
+    rows['event'] = event
+    for i, field in enumerate(('x1', 'y1', 'x2', 'y2')):
+      rows[field] = boxes[:, i]
+    self._n += n
+
+  def of(self, event):
+    """
+    Returns the events of one type.
+    """
+    events = self.array
+    return events[events['event'] == event]
 
 
 class Sort(object):
-  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+  def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, backend='numpy', trajectory_store=None, events=False):
     """
     Sets key parameters for SORT
+
+    backend selects the track state: 'numpy' keeps all tracks in one KalmanBoxBatch and filters them
+    together, 'filterpy' keeps one KalmanBoxTracker per object. Both give the same output.
+    trajectory_store is an optional trajectory_store.TrajectoryStore (numpy backend only) that
+    receives every live track's box each frame; a track's slot is released (and its trajectory
+    spooled) when the track is deleted.
+    With events=True (numpy backend only) every update also fills self.events, a TrackEvents
+    holding the tracks born, confirmed (hit streak reaching min_hits), lost (first frame without
+    a detection) and deleted in that frame, so consumers can react to changes only.
     """
+    if backend not in ('numpy', 'filterpy'):
+      raise ValueError("backend must be 'numpy' or 'filterpy', got %r" % (backend,))
+    if trajectory_store is not None and backend != 'numpy':
+      raise ValueError("trajectory_store requires the numpy backend")
+    if events and backend != 'numpy':
+      raise ValueError("events require the numpy backend")
+    self.events = TrackEvents() if events else None
     self.max_age = max_age
     self.min_hits = min_hits
     self.iou_threshold = iou_threshold
+    self.backend = backend
+    self.trajectory_store = trajectory_store
     self.trackers = []
+    self.batch = KalmanBoxBatch()
     self.frame_count = 0
 
   def update(self, dets=np.empty((0, 5))):
@@ -201,6 +535,8 @@ class Sort(object):
     NOTE: The number of objects returned may differ from the number of detections provided.
     """
     self.frame_count += 1
+    if(self.backend == 'numpy'):
+      return self._update_batch(dets)
     # get predicted locations from existing trackers.
     trks = np.zeros((len(self.trackers), 5))
     to_del = []
@@ -236,6 +572,263 @@ class Sort(object):
       return np.concatenate(ret)
     return np.empty((0,5))
 
+  def propagate(self):
+    """
+    Advances all tracks by one frame on prediction alone, for frames the detector skips.
+
+    Unlike update with no detections, this does not count as a missed frame, so tracks are not
+    aged out by max_age however many frames are propagated. Returns the predicted boxes of the
+    tracks update reported last, in the same format. The next update continues from here.
+    No lifecycle events happen on propagated frames, so events is left empty.
+    """
+    if(self.backend == 'numpy'):
+      if self.events is not None:
+        self.events.clear()
+      batch = self.batch
+      state = batch.predict(coast=True)
+      live = (batch.time_since_update < 1) & ((batch.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+      return np.concatenate((state[live], batch.id[live, None] + 1.), axis=1)[::-1]
+    ret = []
+    for trk in reversed(self.trackers):
+      d = trk.predict(coast=True)[0]
+      if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
+        ret.append(np.concatenate((d,[trk.id+1])).reshape(1,-1))
+    if(len(ret)>0):
+      return np.concatenate(ret)
+    return np.empty((0,5))
+
+  def snapshot(self):
+    """
+    Returns a copy of the complete tracker state (filter means and covariances, hit streaks, ages,
+    frame count and the ID counter) as a dict of NumPy arrays, see restore. numpy backend only.
+    """
+    if(self.backend != 'numpy'):
+      raise ValueError("snapshot requires the numpy backend")
+    state = dict((name, getattr(self.batch, name).copy()) for name in KalmanBoxBatch.columns if name not in ('slot', 'stream'))
+    state['frame_count'] = np.array(self.frame_count)
+    state['id_count'] = np.array(KalmanBoxTracker.count)
+    state['params'] = np.array([self.max_age, self.min_hits, self.iou_threshold])
+    return state
+
+  def restore(self, state):
+    """
+    Replaces the tracker state with one returned by snapshot, so live tracks keep their IDs.
+    """
+    if(self.backend != 'numpy'):
+      raise ValueError("restore requires the numpy backend")
+    batch = KalmanBoxBatch()
+    for name in KalmanBoxBatch.columns:
+      if name in state:
+        setattr(batch, name, np.array(state[name], dtype=getattr(batch, name).dtype))
+    batch.slot = np.full(len(batch.x), -1, dtype=np.int64)
+    batch.stream = np.zeros(len(batch.x), dtype=np.int64)
+    if self.trajectory_store is not None:
+      self.trajectory_store.release(self.batch.slot)
+      batch.slot = self.trajectory_store.acquire(batch.id + 1)
+    self.batch = batch
+    self.frame_count = int(state['frame_count'])
+    KalmanBoxTracker.count = max(KalmanBoxTracker.count, int(state['id_count']))
+
+  def _update_batch(self, dets):
+    """
+    Same steps as update, run over the KalmanBoxBatch with one NumPy call per step.
+    """
+    batch = self.batch
+    store = self.trajectory_store
+    events = self.events
+    if events is not None:
+      events.clear()
+      last = batch.get_state()
+    trks = batch.predict()
+    valid = ~np.any(np.isnan(trks), axis=1)
+    if(not valid.all()):
+      if store is not None:
+        store.release(batch.slot[~valid])
+      if events is not None:
+        events.append(self.frame_count, TRACK_DELETED, batch.id[~valid] + 1, last[~valid])
+      batch.keep(valid)
+      trks = trks[valid]
+    matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets,trks, self.iou_threshold)
+    matched = matched.astype(int)
+    unmatched_dets = unmatched_dets.astype(int)
+
+    # update matched trackers with assigned detections
+    batch.update(matched[:, 1], dets[matched[:, 0], :4])
+
+    # create and initialise new trackers for unmatched detections
+    batch.add(dets[unmatched_dets, :4])
+
+    state = batch.get_state()
+    if events is not None:
+      lost = unmatched_trks[batch.time_since_update[unmatched_trks] == 1]
+      confirmed = matched[batch.hit_streak[matched[:, 1]] == max(self.min_hits, 1), 1]
+      born = np.arange(len(batch) - len(unmatched_dets), len(batch))
+      for event, rows in ((TRACK_BORN, born), (TRACK_CONFIRMED, confirmed), (TRACK_LOST, lost)):
+        events.append(self.frame_count, event, batch.id[rows] + 1, state[rows])
+    if store is not None:
+      new = len(unmatched_dets)
+      if new:
+        batch.slot[-new:] = store.acquire(batch.id[-new:] + 1) # same IDs as the returned tracks
+      store.write(batch.slot, state, self.frame_count)
+
+    # newest tracks first, as the per-object loop reports them
+    live = (batch.time_since_update < 1) & ((batch.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+    ret = np.concatenate((state[live], batch.id[live, None] + 1.), axis=1)[::-1] # +1 as MOT benchmark requires positive
+
+    # remove dead tracklets
+    alive = batch.time_since_update <= self.max_age
+    if store is not None:
+      store.release(batch.slot[~alive])
+    if events is not None:
+      events.append(self.frame_count, TRACK_DELETED, batch.id[~alive] + 1, state[~alive])
+    batch.keep(alive)
+    return ret
+
+class MultiSort(object):
+  def __init__(self, n_streams, max_age=1, min_hits=3, iou_threshold=0.3):
+    """
+    Sets key parameters for SORT, shared by n_streams independent streams (e.g. cameras).
+
+    All streams keep their tracks in one KalmanBoxBatch labelled by stream, so a single call
+    predicts, associates and updates every stream with one NumPy operation per step. Each stream
+    behaves exactly like its own Sort instance; track IDs are unique across streams.
+    """
+    self.n_streams = n_streams
+    self.max_age = max_age
+    self.min_hits = min_hits
+    self.iou_threshold = iou_threshold
+    self.batch = KalmanBoxBatch()
+    self.frame_count = 0
+
+  def update(self, dets_per_stream):
+    """
+    Params:
+      dets_per_stream - a list with one Sort.update style detection array per stream
+    Requires: this method must be called once per frame with an entry for every stream (use np.empty((0, 5))
+    for streams without detections).
+    Returns a list with one Sort.update style result array per stream.
+    """
+    if(len(dets_per_stream) != self.n_streams):
+      raise ValueError("expected detections for %d streams, got %d" % (self.n_streams, len(dets_per_stream)))
+    offsets = np.concatenate(([0], np.cumsum([len(d) for d in dets_per_stream])))
+    dets = np.concatenate([np.reshape(d, (-1, 5)) for d in dets_per_stream]) if offsets[-1] else np.empty((0, 5))
+    return self.update_ragged(dets, offsets)
+
+  def update_ragged(self, dets, offsets):
+    """
+    Params:
+      dets - the detections of all streams stacked in one array, stream by stream
+      offsets - n_streams + 1 row offsets, the detections of stream s being dets[offsets[s]:offsets[s+1]]
+    Returns a list with one Sort.update style result array per stream.
+    """
+    offsets = np.asarray(offsets)
+    if(len(offsets) != self.n_streams + 1):
+      raise ValueError("expected %d offsets, got %d" % (self.n_streams + 1, len(offsets)))
+    self.frame_count += 1
+    batch = self.batch
+    det_stream = np.repeat(np.arange(self.n_streams), np.diff(offsets))
+    trks = batch.predict()
+    valid = ~np.any(np.isnan(trks), axis=1)
+    if(not valid.all()):
+      batch.keep(valid)
+      trks = trks[valid]
+    matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks, self.iou_threshold,
+                                                                               det_stream, batch.stream)
+    matched = matched.astype(int)
+    unmatched_dets = unmatched_dets.astype(int)
+    batch.update(matched[:, 1], dets[matched[:, 0], :4])
+    batch.add(dets[unmatched_dets, :4], det_stream[unmatched_dets])
+
+    live = (batch.time_since_update < 1) & ((batch.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+    ret = np.concatenate((batch.get_state()[live], batch.id[live, None] + 1.), axis=1)[::-1] # +1 as MOT benchmark requires positive
+    streams = batch.stream[live][::-1]
+    order = np.argsort(streams, kind='stable')
+    results = np.split(ret[order], np.cumsum(np.bincount(streams, minlength=self.n_streams))[:-1])
+
+    batch.keep(batch.time_since_update <= self.max_age)
+    return results
+
+
+def load_detections(seq_dets_fn, cache_dir=None):
+  """
+  Loads a MOT det.txt as an array sorted by frame plus per-frame row offsets.
+
+  Rows of frame f are seq_dets[offsets[f]:offsets[f+1]]. When cache_dir is given the parsed
+  result is stored there as .npz and reused while the det.txt size and mtime are unchanged.
+  """
+  stat = os.stat(seq_dets_fn)
+  key = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+  if(cache_dir is not None):
+    cache_fn = os.path.join(cache_dir, os.path.abspath(seq_dets_fn).strip(os.path.sep).replace(os.path.sep, '_') + '.npz')
+    if os.path.exists(cache_fn):
+      with np.load(cache_fn) as cached:
+        if np.array_equal(cached['key'], key):
+          return cached['dets'], cached['offsets']
+  seq_dets = np.loadtxt(seq_dets_fn, delimiter=',', ndmin=2)
+  seq_dets = seq_dets[np.argsort(seq_dets[:, 0], kind='stable')]
+  frames = seq_dets[:, 0].astype(np.int64)
+  offsets = np.searchsorted(frames, np.arange(frames.max() + 2 if len(frames) else 1))
+  if(cache_dir is not None):
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir)
+    np.savez(cache_fn, key=key, dets=seq_dets, offsets=offsets)
+  return seq_dets, offsets
+
+
+def track_sequence(seq_dets_fn, seq, args, output_dir='output', display=None):
+  """
+  Runs a fresh Sort over one sequence and writes its MOT results to output_dir/<seq>.txt.
+
+  IDs restart at 1 for every sequence so the output does not depend on the order, or the
+  process, in which sequences are run. display is an optional (fig, ax, colours) tuple.
+  Returns (frames, seconds spent in Sort.update).
+  """
+  KalmanBoxTracker.count = 0
+  mot_tracker = Sort(max_age=args.max_age, 
+                     min_hits=args.min_hits,
+                     iou_threshold=args.iou_threshold,
+                     backend=args.backend) #create instance of the SORT tracker
+  seq_dets, offsets = load_detections(seq_dets_fn, args.cache_dir or None)
+  total_time = 0.0
+  results = []
+
+  print("Processing %s."%(seq))
+  for frame in range(1, len(offsets) - 1): #detection and frame numbers begin at 1
+    dets = seq_dets[offsets[frame]:offsets[frame + 1], 2:7].copy()
+    dets[:, 2:4] += dets[:, 0:2] #convert to [x1,y1,w,h] to [x1,y1,x2,y2]
+
+    if(display):
+      fig, ax1, colours = display
+      fn = os.path.join('mot_benchmark', args.phase, seq, 'img1', '%06d.jpg'%(frame))
+      im =io.imread(fn)
+      ax1.imshow(im)
+      plt.title(seq + ' Tracked Targets')
+
+    start_time = time.time()
+    trackers = mot_tracker.update(dets)
+    cycle_time = time.time() - start_time
+    total_time += cycle_time
+
+    if(len(trackers)):
+      results.append(np.column_stack((np.full(len(trackers), frame), trackers[:, 4], trackers[:, :2], trackers[:, 2:4] - trackers[:, :2])))
+    if(display):
+      for d in trackers:
+        d = d.astype(np.int32)
+        ax1.add_patch(patches.Rectangle((d[0],d[1]),d[2]-d[0],d[3]-d[1],fill=False,lw=3,ec=colours[d[4]%32,:]))
+      fig.canvas.flush_events()
+      plt.draw()
+      ax1.cla()
+
+  with open(os.path.join(output_dir, '%s.txt'%(seq)),'w') as out_file:
+    if(len(results)):
+      np.savetxt(out_file, np.concatenate(results), fmt='%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1')
+  return len(offsets) - 2, total_time
+
+
+def _track_sequence_job(job):
+  return track_sequence(*job)
+
+
 def parse_args():
     """Parse input arguments."""
     parser = argparse.ArgumentParser(description='SORT demo')
@@ -249,6 +842,11 @@ def parse_args():
                         help="Minimum number of associated detections before track is initialised.", 
                         type=int, default=3)
     parser.add_argument("--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3)
+    parser.add_argument("--backend", help="Track state backend: numpy (batched) or filterpy (per object).",
+                        type=str, choices=['numpy', 'filterpy'], default='numpy')
+    parser.add_argument("--workers", help="Number of processes tracking sequences in parallel.", type=int, default=1)
+    parser.add_argument("--cache_dir", help="Directory for parsed detection caches ('' disables caching).", type=str, default='cache')
+    parser.add_argument("--output_dir", help="Directory for MOT result files.", type=str, default='output')
     args = parser.parse_args()
     return args
 
@@ -268,45 +866,20 @@ if __name__ == '__main__':
     fig = plt.figure()
     ax1 = fig.add_subplot(111, aspect='equal')
 
-  if not os.path.exists('output'):
-    os.makedirs('output')
+  if not os.path.exists(args.output_dir):
+    os.makedirs(args.output_dir)
   pattern = os.path.join(args.seq_path, phase, '*', 'det', 'det.txt')
-  for seq_dets_fn in glob.glob(pattern):
-    mot_tracker = Sort(max_age=args.max_age, 
-                       min_hits=args.min_hits,
-                       iou_threshold=args.iou_threshold) #create instance of the SORT tracker
-    seq_dets = np.loadtxt(seq_dets_fn, delimiter=',')
-    seq = seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0]
-    
-    with open(os.path.join('output', '%s.txt'%(seq)),'w') as out_file:
-      print("Processing %s."%(seq))
-      for frame in range(int(seq_dets[:,0].max())):
-        frame += 1 #detection and frame numbers begin at 1
-        dets = seq_dets[seq_dets[:, 0]==frame, 2:7]
-        dets[:, 2:4] += dets[:, 0:2] #convert to [x1,y1,w,h] to [x1,y1,x2,y2]
-        total_frames += 1
-
-        if(display):
-          fn = os.path.join('mot_benchmark', phase, seq, 'img1', '%06d.jpg'%(frame))
-          im =io.imread(fn)
-          ax1.imshow(im)
-          plt.title(seq + ' Tracked Targets')
-
-        start_time = time.time()
-        trackers = mot_tracker.update(dets)
-        cycle_time = time.time() - start_time
-        total_time += cycle_time
-
-        for d in trackers:
-          print('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1'%(frame,d[4],d[0],d[1],d[2]-d[0],d[3]-d[1]),file=out_file)
-          if(display):
-            d = d.astype(np.int32)
-            ax1.add_patch(patches.Rectangle((d[0],d[1]),d[2]-d[0],d[3]-d[1],fill=False,lw=3,ec=colours[d[4]%32,:]))
-
-        if(display):
-          fig.canvas.flush_events()
-          plt.draw()
-          ax1.cla()
+  jobs = [(seq_dets_fn, seq_dets_fn[pattern.find('*'):].split(os.path.sep)[0], args, args.output_dir)
+          for seq_dets_fn in sorted(glob.glob(pattern))]
+  if(display or args.workers <= 1):
+    stats = [track_sequence(*job, display=(fig, ax1, colours) if display else None) for job in jobs]
+  else:
+    from multiprocessing import Pool
+    with Pool(args.workers) as pool:
+      stats = pool.map(_track_sequence_job, jobs, chunksize=1)
+  for frames, seq_time in stats:
+    total_frames += frames
+    total_time += seq_time
 
   print("Total Tracking took: %.3f seconds for %d frames or %.1f FPS" % (total_time, total_frames, total_frames / total_time))
 
@@ -0,0 +1,206 @@
+"""
+Micro-benchmarks for the SORT tracker on synthetic crowded scenes.
+
+Scenes are generated offline from a seed, so the same arguments always replay the same
+detections. For every object count the per-frame latency percentiles (p50/p95/p99) and the peak
+traced memory of Sort.update, KalmanBoxTracker predict/update and
+associate_detections_to_trackers are written as JSON, and can be checked against a stored
+baseline:
+
+    $ python sort_benchmark.py --objects 25,50,100,200 --output bench.json
+    $ python sort_benchmark.py --objects 25,50,100,200 --baseline bench.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from sort import Sort, KalmanBoxTracker, associate_detections_to_trackers
+
+
+def synthetic_scene(n_objects, n_frames=300, birth_rate=0.02, death_rate=0.02, occlusion=0.1,
+                    jitter=2.0, frame_size=(1920, 1080), seed=0):
+  """
+  Generates deterministic detections for a scene with about n_objects moving boxes.
+
+  Each frame every object dies with probability death_rate and is replaced by a newborn one with
+  probability birth_rate per missing slot, so the population hovers around n_objects. Live
+  objects are dropped from the detections of a frame with probability occlusion and observed
+  with gaussian jitter (pixels) on every coordinate.
+  Returns a list of n_frames arrays in the Sort.update format [[x1,y1,x2,y2,score],...].
+  """
+  rng = np.random.RandomState(seed)
+  size = np.array(frame_size, dtype=float)
+
+  def spawn(n):
+    wh = rng.uniform(30, 160, (n, 2))
+    return rng.uniform(0, 1, (n, 2)) * size, rng.normal(0, 5, (n, 2)), wh
+
+  centre, velocity, wh = spawn(n_objects)
+  alive = np.ones(n_objects, dtype=bool)
+  frames = []
+  for _ in range(n_frames):
+    alive &= rng.uniform(size=n_objects) >= death_rate
+    born = ~alive & (rng.uniform(size=n_objects) < birth_rate)
+    if(born.any()):
+      centre[born], velocity[born], wh[born] = spawn(born.sum())
+      alive |= born
+    centre += velocity
+    outside = np.any((centre < 0) | (centre > size), axis=1)
+    velocity[outside] *= -1
+    seen = alive & (rng.uniform(size=n_objects) >= occlusion)
+    c = centre[seen] + rng.normal(0, jitter, (seen.sum(), 2))
+    half = wh[seen] / 2.
+    score = rng.uniform(0.5, 1., (seen.sum(), 1))
+    frames.append(np.hstack((c - half, c + half, score)))
+  return frames
+
+
+def summarise(latencies, peak_bytes):
+  """
+  Reduces per-frame latencies (seconds) to the reported statistics in milliseconds.
+  """
+  ms = np.asarray(latencies) * 1000.
+  return {'frames': len(ms),
+          'p50_ms': float(np.percentile(ms, 50)),
+          'p95_ms': float(np.percentile(ms, 95)),
+          'p99_ms': float(np.percentile(ms, 99)),
+          'mean_ms': float(ms.mean()),
+          'peak_kib': peak_bytes / 1024.}
+
+
+def bench_sort(frames, backend='numpy'):
+  """
+  Returns per-frame latencies of Sort.update.
+  """
+  KalmanBoxTracker.count = 0
+  tracker = Sort(max_age=3, min_hits=3, backend=backend)
+  latencies = []
+  for dets in frames:
+    start = time.perf_counter()
+    tracker.update(dets)
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+
+def bench_kalman(frames):
+  """
+  Returns per-frame latencies of predicting every KalmanBoxTracker and updating it with one
+  detection of the frame (trackers are created from the first frame).
+  """
+  trackers = [KalmanBoxTracker(d) for d in frames[0]]
+  latencies = []
+  for dets in frames[1:]:
+    start = time.perf_counter()
+    for i, trk in enumerate(trackers):
+      trk.predict()
+      if(i < len(dets)):
+        trk.update(dets[i])
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+
+def bench_associate(frames):
+  """
+  Returns per-frame latencies of associating each frame's detections with the previous frame's.
+  """
+  latencies = []
+  for prev, dets in zip(frames[:-1], frames[1:]):
+    start = time.perf_counter()
+    associate_detections_to_trackers(dets, prev, 0.3)
+    latencies.append(time.perf_counter() - start)
+  return latencies
+
+
+BENCHMARKS = {
+  'sort': bench_sort,
+  'sort_filterpy': lambda frames: bench_sort(frames, backend='filterpy'),
+  'kalman_box_tracker': bench_kalman,
+  'associate': bench_associate,
+}
+
+
+def run(object_counts, names, n_frames=300, repeat=3, seed=0, **scene_args):
+  """
+  Runs every named benchmark for every object count and returns the JSON-ready results.
+
+  Latency is the best of repeat runs per frame; peak memory comes from one extra run under
+  tracemalloc, kept separate so tracing does not inflate the timings.
+  """
+  results = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                      'frames': n_frames, 'repeat': repeat, 'seed': seed, 'scene': scene_args},
+             'results': {}}
+  for name in names:
+    curve = {}
+    for n in object_counts:
+      frames = synthetic_scene(n, n_frames=n_frames, seed=seed, **scene_args)
+      latencies = np.min([BENCHMARKS[name](frames) for _ in range(repeat)], axis=0)
+      tracemalloc.start()
+      BENCHMARKS[name](frames)
+      _, peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      curve[str(n)] = summarise(latencies, peak)
+      print('%-20s objects=%-5d p50=%8.3fms p95=%8.3fms p99=%8.3fms peak=%9.1fKiB' % (
+        name, n, curve[str(n)]['p50_ms'], curve[str(n)]['p95_ms'], curve[str(n)]['p99_ms'], curve[str(n)]['peak_kib']))
+    results['results'][name] = curve
+  return results
+
+
+def compare(results, baseline, tolerance=0.2, metric='p95_ms'):
+  """
+  Returns a list of (benchmark, objects, baseline, current) entries where metric regressed by
+  more than tolerance (a fraction) against baseline. Entries missing from either side are skipped.
+  """
+  regressions = []
+  for name, curve in results['results'].items():
+    for n, stats in curve.items():
+      old = baseline.get('results', {}).get(name, {}).get(n)
+      if old is not None and stats[metric] > old[metric] * (1. + tolerance):
+        regressions.append((name, n, old[metric], stats[metric]))
+  return regressions
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description='SORT micro-benchmarks')
+    parser.add_argument("--objects", help="Comma separated object counts of the scaling curve.", type=str, default='10,50,100,200')
+    parser.add_argument("--benchmarks", help="Comma separated benchmarks to run.", type=str, default=','.join(BENCHMARKS))
+    parser.add_argument("--frames", help="Frames per synthetic scene.", type=int, default=300)
+    parser.add_argument("--repeat", help="Runs per benchmark, the fastest is kept per frame.", type=int, default=3)
+    parser.add_argument("--seed", help="Scene random seed.", type=int, default=0)
+    parser.add_argument("--birth_rate", help="Per-frame probability of a missing object being born.", type=float, default=0.02)
+    parser.add_argument("--death_rate", help="Per-frame probability of an object dying.", type=float, default=0.02)
+    parser.add_argument("--occlusion", help="Per-frame probability of an object being missed.", type=float, default=0.1)
+    parser.add_argument("--jitter", help="Detection noise in pixels.", type=float, default=2.0)
+    parser.add_argument("--output", help="Write results as JSON to this file.", type=str, default=None)
+    parser.add_argument("--baseline", help="JSON results to compare against.", type=str, default=None)
+    parser.add_argument("--tolerance", help="Allowed p95 slowdown against the baseline as a fraction.", type=float, default=0.2)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  names = args.benchmarks.split(',')
+  unknown = [name for name in names if name not in BENCHMARKS]
+  if unknown:
+    sys.exit('Unknown benchmark(s): %s' % ', '.join(unknown))
+  results = run([int(n) for n in args.objects.split(',')], names, n_frames=args.frames, repeat=args.repeat,
+                seed=args.seed, birth_rate=args.birth_rate, death_rate=args.death_rate,
+                occlusion=args.occlusion, jitter=args.jitter)
+  if(args.output):
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2)
+  if(args.baseline):
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+    for name, n, old, new in regressions:
+      print('REGRESSION %s objects=%s p95 %.3fms -> %.3fms' % (name, n, old, new))
+    if regressions:
+      sys.exit(1)
@@ -0,0 +1,171 @@
+"""
+Bounded-memory trajectory storage for long-running SORT streams.
+
+Every live track owns a slot in preallocated float32 ring buffers holding its last `length`
+boxes; slots are recycled when tracks die, so memory depends on the number of live tracks and
+not on uptime. With a spool_dir, trajectories are streamed to disk in fixed-size chunk files
+(spool_dir/trajectories_000000.npy, ...), each a structured array with fields
+frame, id, x1, y1, x2, y2 (id as reported by Sort.update): a track's points are spooled
+whenever its ring buffer has filled up and the rest when its slot is released (the track
+finished), so every trajectory is complete on disk and kept in frame order per track. Full
+chunks are written by a background thread, so the frame loop never waits for the disk unless
+max_pending chunks are already waiting.
+"""
+import os
+import queue
+import threading
+
+import numpy as np
+
+POINT_DTYPE = np.dtype([('frame', np.int64), ('id', np.int64),
+                        ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32)])
+
+
+class TrajectoryStore(object):
+  """
+  Ring-buffer store of the recent boxes of every live track, indexed by slot.
+  """
+  def __init__(self, capacity=256, length=32, spool_dir=None, chunk_rows=65536, max_pending=4):
+    """
+    capacity is the initial number of slots (doubled when exhausted), length the number of
+    positions kept per track, chunk_rows the number of points per spooled chunk file and
+    max_pending the number of full chunks that may wait for the writer thread.
+    """
+    self.length = length
+    self.boxes = np.zeros((capacity, length, 4), dtype=np.float32)
+    self.frames = np.zeros((capacity, length), dtype=np.int64)
+    self.head = np.zeros(capacity, dtype=np.int64)
+    self.count = np.zeros(capacity, dtype=np.int64)
+    self.track_id = np.full(capacity, -1, dtype=np.int64)
+    self._free = list(range(capacity - 1, -1, -1))
+    # _order[h] lists ring positions oldest to newest when the next write goes to position h
+    self._order = (np.arange(length)[:, None] + np.arange(length)[None, :]) % length
+    self.spool_dir = spool_dir
+    self.chunk_rows = chunk_rows
+    self.chunks_written = 0
+    self._chunks = 0
+    self._spool = None
+    self._spooled = 0
+    self._thread = None
+    if spool_dir is not None:
+      if not os.path.exists(spool_dir):
+        os.makedirs(spool_dir)
+      self._spool = np.zeros(chunk_rows, dtype=POINT_DTYPE)
+      self._queue = queue.Queue(max_pending)
+      self._thread = threading.Thread(target=self._run, name='trajectory-writer', daemon=True)
+      self._thread.start()
+
+  @property
+  def capacity(self):
+    return len(self.head)
+
+  def _grow(self):
+    old = self.capacity
+    new = max(1, 2 * old)
+    self.boxes = np.concatenate((self.boxes, np.zeros((new - old, self.length, 4), dtype=np.float32)))
+    self.frames = np.concatenate((self.frames, np.zeros((new - old, self.length), dtype=np.int64)))
+    self.head = np.concatenate((self.head, np.zeros(new - old, dtype=np.int64)))
+    self.count = np.concatenate((self.count, np.zeros(new - old, dtype=np.int64)))
+    self.track_id = np.concatenate((self.track_id, np.full(new - old, -1, dtype=np.int64)))
+    self._free.extend(range(new - 1, old - 1, -1))
+
+  def acquire(self, ids):
+    """
+    Assigns a free slot to each track id and returns the slots.
+    """
+    while len(self._free) < len(ids):
+      self._grow()
+    slots = np.array([self._free.pop() for _ in range(len(ids))], dtype=np.int64)
+    self.track_id[slots] = ids
+    self.head[slots] = 0
+    self.count[slots] = 0
+    return slots
+
+  def release(self, slots):
+    """
+    Returns the slots of finished tracks to the free list, spooling their remaining points.
+    """
+    if self._thread is not None:
+      slots = np.asarray(slots, dtype=np.int64)
+      self._spool_points(slots, self.head[slots])
+    self.track_id[slots] = -1
+    self._free.extend(int(s) for s in slots)
+
+  def write(self, slots, boxes, frame):
+    """
+    Appends one box per slot observed at frame.
+    """
+    if(len(slots) == 0):
+      return
+    head = self.head[slots]
+    self.boxes[slots, head] = boxes
+    self.frames[slots, head] = frame
+    self.head[slots] = (head + 1) % self.length
+    self.count[slots] += 1
+    if self._thread is not None:
+      # a full ring (head back at 0) is spooled before it is overwritten
+      full = slots[self.head[slots] == 0]
+      self._spool_points(full, np.full(len(full), self.length))
+
+  def last(self, slot, k=None, out=None):
+    """
+    Returns the last k (default all kept) boxes of the track in slot, oldest first.
+
+    With a preallocated out array of shape (k, 4) no memory is allocated.
+    """
+    n = min(self.count[slot], self.length)
+    k = n if k is None else min(k, n)
+    return np.take(self.boxes[slot], self._order[self.head[slot]][self.length - k:], axis=0, out=out)
+
+  def _spool_points(self, slots, n):
+    # the first n[i] ring positions of slots[i], in the order they were written
+    slot = np.repeat(slots, n)
+    pos = np.arange(len(slot)) - np.repeat(np.cumsum(n) - n, n)
+    start = 0
+    while start < len(slot):
+      k = min(len(slot) - start, len(self._spool) - self._spooled)
+      rs, rp = slot[start:start + k], pos[start:start + k]
+      rows = self._spool[self._spooled:self._spooled + k]
+      rows['frame'] = self.frames[rs, rp]
+      rows['id'] = self.track_id[rs]
+      for i, field in enumerate(('x1', 'y1', 'x2', 'y2')):
+        rows[field] = self.boxes[rs, rp, i]
+      self._spooled += k
+      start += k
+      if self._spooled == len(self._spool):
+        self.flush()
+
+  def flush(self):
+    """
+    Hands the spooled points to the writer thread as the next chunk file.
+    """
+    if self._thread is None or self._spooled == 0:
+      return
+    path = os.path.join(self.spool_dir, 'trajectories_%06d.npy' % self._chunks)
+    self._queue.put((path, self._spool[:self._spooled]))
+    self._chunks += 1
+    self._spool = np.zeros(self.chunk_rows, dtype=POINT_DTYPE)
+    self._spooled = 0
+
+  def _run(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      np.save(*item)
+      self.chunks_written += 1
+
+  def close(self):
+    """
+    Spools the points of the live tracks, writes every chunk and stops the writer thread; no
+    more points are spooled afterwards.
+    """
+    if self._thread is None:
+      return
+    live = np.flatnonzero(self.track_id >= 0)
+    self._spool_points(live, self.head[live])
+    self.flush()
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+    self._spool = None
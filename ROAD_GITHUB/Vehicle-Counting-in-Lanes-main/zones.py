@@ -0,0 +1,280 @@
+"""
+Lane zones and line-crossing counting for the lane counter.
+
+Lanes are read from a JSON zone file (see zones.json):
+
+    {"frame_size": [1920, 1080],          # coordinate space of the points
+     "centroid_offset": [0, -40],         # added to box centres before testing
+     "lanes": [{"name": "A", "color": [0, 0, 255],          # BGR, for drawing
+                "polygon": [[308, 789], [711, 807], ...],
+                "line": [[308, 789], [711, 807]]}, ...],   # optional, defaults to the
+                                                           # first two polygon points
+     "ground": {"image": [[x, y], ...],   # optional, four reference points in the view and
+                "world": [[X, Y], ...]}}  # their road-plane positions in metres
+
+A vehicle is counted for a lane when the segment from its previous to its current centroid
+crosses the lane's counting line, which works for lines at any angle. Zone membership uses a
+label map rasterised once per view (0 = no lane, i + 1 = lane i), so finding the lane of every
+track centroid is a single array lookup. The ground reference points, when given, define the
+image-to-road-plane homography used for speeds (see lane_metrics.py).
+"""
+import json
+
+import cv2
+import numpy as np
+
+
+class Lane(object):
+  """
+  One named lane: its zone polygon, counting line and display colour.
+  """
+  def __init__(self, name, polygon, line=None, color=(0, 255, 0)):
+    self.name = name
+    self.polygon = np.array(polygon, np.int32)
+    self.line = np.array(line if line is not None else polygon[:2], float).reshape(2, 2)
+    self.color = tuple(int(c) for c in color)
+
+
+class ZoneConfig(object):
+  """
+  The lanes of one camera view and the coordinate space they are defined in.
+  """
+  def __init__(self, lanes, frame_size=(1920, 1080), centroid_offset=(0, 0), ground=None):
+    """
+    ground is None or a dict of four 'image' points and their 'world' positions in metres.
+    """
+    self.lanes = list(lanes)
+    self.frame_size = tuple(int(v) for v in frame_size)
+    self.centroid_offset = np.array(centroid_offset, float)
+    self.ground = None
+    if ground is not None:
+      self.ground = dict((k, np.array(ground[k], float).reshape(4, 2)) for k in ('image', 'world'))
+
+  @property
+  def names(self):
+    return [lane.name for lane in self.lanes]
+
+  @property
+  def lines(self):
+    """
+    L x 2 x 2 array of counting line end points.
+    """
+    return np.array([lane.line for lane in self.lanes]).reshape(-1, 2, 2)
+
+  @property
+  def homography(self):
+    """
+    3 x 3 homography from zone coordinates to the road plane in metres, None without ground points.
+    """
+    if self.ground is None:
+      return None
+    return cv2.getPerspectiveTransform(self.ground['image'].astype(np.float32), self.ground['world'].astype(np.float32))
+
+  def label_map(self):
+    """
+    Rasterises the lane polygons into a frame_size uint8 map holding i + 1 inside lane i and 0
+    elsewhere; where polygons overlap the later lane wins.
+    """
+    if len(self.lanes) > 255:
+      raise ValueError("a uint8 label map holds at most 255 lanes, got %d" % len(self.lanes))
+    labels = np.zeros((self.frame_size[1], self.frame_size[0]), dtype=np.uint8)
+    for i, lane in enumerate(self.lanes):
+      cv2.fillPoly(labels, [lane.polygon], i + 1)
+    return labels
+
+  def as_dict(self):
+    config = {'frame_size': list(self.frame_size),
+              'centroid_offset': self.centroid_offset.tolist(),
+              'lanes': [{'name': lane.name, 'color': list(lane.color), 'polygon': lane.polygon.tolist(),
+                         'line': lane.line.tolist()} for lane in self.lanes]}
+    if self.ground is not None:
+      config['ground'] = dict((k, v.tolist()) for k, v in self.ground.items())
+    return config
+
+
+def load_zones(path):
+  """
+  Reads a zone file into a ZoneConfig.
+  """
+  with open(path, 'r') as f:
+    config = json.load(f)
+  lanes = [Lane(lane['name'], lane['polygon'], lane.get('line'), lane.get('color', (0, 255, 0)))
+           for lane in config['lanes']]
+  return ZoneConfig(lanes, config.get('frame_size', (1920, 1080)), config.get('centroid_offset', (0, 0)),
+                    config.get('ground'))
+
+
+def save_zones(path, zones):
+  """
+  Writes a ZoneConfig as a zone file.
+  """
+  with open(path, 'w') as f:
+    json.dump(zones.as_dict(), f, indent=2)
+
+
+def lane_of(label_map, points):
+  """
+  Returns the label (0 = none, i + 1 = lane i) under each of the N x 2 points.
+  """
+  h, w = label_map.shape
+  x = np.clip(points[:, 0].astype(np.intp), 0, w - 1)
+  y = np.clip(points[:, 1].astype(np.intp), 0, h - 1)
+  inside = (points[:, 0] >= 0) & (points[:, 0] < w) & (points[:, 1] >= 0) & (points[:, 1] < h)
+  return np.where(inside, label_map[y, x], 0)
+
+
+def track_centroids(tracks, offset=(0, 0)):
+  """
+  Returns the N x 2 box centres of Sort.update style rows, shifted by offset.
+  """
+  tracks = np.asarray(tracks, float).reshape(-1, 5)
+  return (tracks[:, :2] + tracks[:, 2:4]) / 2. + offset
+
+
+def to_ground(homography, points):
+  """
+  Maps N x 2 points through a 3 x 3 homography in one batched transform.
+  """
+  h = points @ homography[:2, :2].T + homography[:2, 2]
+  w = points @ homography[2, :2] + homography[2, 2]
+  return h / w[:, None]
+
+
+def segments_cross(p, q, lines):
+  """
+  Returns an N x L boolean array telling whether segment p[i] -> q[i] crosses line l.
+
+  p and q are N x 2 arrays, lines an L x 2 x 2 array of line end points.
+  """
+  a = lines[None, :, 0]
+  b = lines[None, :, 1]
+  p = p[:, None]
+  q = q[:, None]
+
+  def cross(o, u, v):
+    return (u[..., 0] - o[..., 0]) * (v[..., 1] - o[..., 1]) - (u[..., 1] - o[..., 1]) * (v[..., 0] - o[..., 0])
+
+  d1, d2 = cross(a, b, p), cross(a, b, q)
+  d3, d4 = cross(p, q, a), cross(p, q, b)
+  return (d1 * d2 <= 0) & (d3 * d4 <= 0) & ~((d1 == 0) & (d2 == 0))
+
+
+def distance_to_lines(points, lines):
+  """
+  Returns the N x L distances from each of the N x 2 points to each line segment of lines.
+  """
+  a = lines[None, :, 0]
+  ab = lines[None, :, 1] - a
+  ap = points[:, None] - a
+  t = np.clip((ap * ab).sum(axis=2) / np.maximum((ab * ab).sum(axis=2), 1e-12), 0., 1.)
+  return np.hypot(*np.moveaxis(ap - t[..., None] * ab, 2, 0))
+
+
+def match_tracks(known_ids, ids):
+  """
+  Lines up current track ids with the sorted remembered known_ids: returns (pos, known), where
+  known marks the ids that are remembered and pos[known] is their index in known_ids.
+  """
+  if(len(known_ids) == 0):
+    return np.zeros(len(ids), dtype=np.intp), np.zeros(len(ids), dtype=bool)
+  pos = np.minimum(np.searchsorted(known_ids, ids), len(known_ids) - 1)
+  return pos, known_ids[pos] == ids
+
+
+def merge_tracks(frame, expire, ids, rows, known_ids, known_rows, last_seen, pos, known):
+  """
+  Merges the current tracks (ids and the per-track arrays rows, seen at frame) with the
+  remembered ones (known_ids, known_rows, last_seen) that are not in this frame and were seen
+  less than expire frames ago; pos and known are from match_tracks.
+  Returns (ids, last_seen, rows) sorted by id.
+  """
+  absent = np.ones(len(known_ids), dtype=bool)
+  absent[pos[known]] = False
+  absent &= frame - last_seen < expire
+  merged_ids = np.concatenate((ids, known_ids[absent]))
+  order = np.argsort(merged_ids, kind='stable')
+  last_seen = np.concatenate((np.full(len(ids), frame), last_seen[absent]))[order]
+  rows = [np.concatenate((row, known_row[absent]))[order] for row, known_row in zip(rows, known_rows)]
+  return merged_ids[order], last_seen, rows
+
+
+class LineCrossingCounter(object):
+  """
+  Counts tracks crossing each lane's counting line, once per track and lane.
+
+  Only tracks seen within the last `expire` frames are remembered (their last centroid and
+  which lanes already counted them), so the per-frame cost depends on live tracks, not on how
+  many vehicles have been counted since start.
+
+  After each update, crossed_rows and crossed_lanes hold the input rows and lane indices of the
+  crossings counted in that frame. Every update also refreshes, per lane, `occupancy` (tracks whose centroid is inside the lane
+  polygon) and `queue` (those of them that moved less than stopped_speed pixels since their
+  previous centroid), and `speed` holds the centroid displacement of each input row since its
+  previous update (NaN for tracks seen for the first time).
+  """
+  def __init__(self, zones, expire=30, stopped_speed=2.0):
+    self.zones = zones
+    self.expire = expire
+    self.stopped_speed = stopped_speed
+    self.labels = zones.label_map()
+    self.frame = 0
+    self.counts = np.zeros(len(zones.lanes), dtype=np.int64)
+    self.occupancy = np.zeros(len(zones.lanes), dtype=np.int64)
+    self.queue = np.zeros(len(zones.lanes), dtype=np.int64)
+    self.crossed_rows = np.empty(0, dtype=np.intp)
+    self.crossed_lanes = np.empty(0, dtype=np.intp)
+    self.speed = np.empty(0)
+    self.ids = np.empty(0, dtype=np.int64)
+    self.points = np.empty((0, 2))
+    self.last_seen = np.empty(0, dtype=np.int64)
+    self.counted = np.zeros((0, len(zones.lanes)), dtype=bool)
+
+  def update(self, tracks):
+    """
+    Feeds one frame of Sort.update output and returns the per-lane counts.
+    """
+    self.frame += 1
+    tracks = np.asarray(tracks, float).reshape(-1, 5)
+    ids = tracks[:, 4].astype(np.int64)
+    points = track_centroids(tracks, self.zones.centroid_offset)
+
+    pos, known = match_tracks(self.ids, ids)
+    counted = np.zeros((len(ids), len(self.counts)), dtype=bool)
+    counted[known] = self.counted[pos[known]]
+
+    crossed = np.zeros_like(counted)
+    crossed[known] = segments_cross(self.points[pos[known]], points[known], self.zones.lines)
+    crossed &= ~counted
+    self.counts += crossed.sum(axis=0)
+    counted |= crossed
+    self.crossed_rows, self.crossed_lanes = np.nonzero(crossed)
+
+    lane = lane_of(self.labels, points)
+    self.speed = np.full(len(ids), np.nan)
+    self.speed[known] = np.hypot(*(points[known] - self.points[pos[known]]).T)
+    stopped = self.speed < self.stopped_speed
+    n = len(self.counts) + 1
+    self.occupancy = np.bincount(lane, minlength=n)[1:]
+    self.queue = np.bincount(lane[stopped], minlength=n)[1:]
+
+    self.ids, self.last_seen, (self.points, self.counted) = merge_tracks(
+      self.frame, self.expire, ids, (points, counted), self.ids, (self.points, self.counted), self.last_seen, pos, known)
+    return self.counts
+
+  def state(self):
+    """
+    Returns the counter state as a dict of arrays, e.g. for checkpoint extras.
+    """
+    return {'lane_counts': self.counts.copy(), 'lane_ids': self.ids.copy(), 'lane_points': self.points.copy(),
+            'lane_last_seen': self.last_seen - self.frame, 'lane_counted': self.counted.copy()}
+
+  def restore(self, state):
+    """
+    Restores a state returned by state().
+    """
+    self.frame = 0
+    self.counts = np.array(state['lane_counts'], dtype=np.int64)
+    self.ids = np.array(state['lane_ids'], dtype=np.int64)
+    self.points = np.array(state['lane_points'], float).reshape(-1, 2)
+    self.last_seen = np.array(state['lane_last_seen'], dtype=np.int64)
+    self.counted = np.array(state['lane_counted'], dtype=bool).reshape(len(self.ids), len(self.counts))
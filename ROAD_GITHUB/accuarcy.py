@@ -1,11 +1,12 @@
 import cv2
-import numpy as np
 import time
 import os
 import tkinter as tk
 from tkinter import messagebox, ttk
-import csv
-from sklearn.metrics import precision_score, recall_score, f1_score
+from traffic_detection import BACKENDS, DetectorSession, class_ids, decode_outputs
+from traffic_alerts import AlertDispatcher, BufferedCsvWriter, CongestionMonitor
+from traffic_metrics import CountMetrics, read_ground_truth
+from traffic_recorder import VideoRecorder
 
 class TrafficControlApp:
     def __init__(self, root):
@@ -16,8 +17,15 @@ class TrafficControlApp:
         self.red_threshold = tk.IntVar()
         self.max_vehicle_limit = tk.IntVar()
         self.record_screen = tk.BooleanVar()
+        self.backend = tk.StringVar(value='default')
+        self.input_size = tk.IntVar(value=416)
+
+        # Load the YOLO model once, in the background while the form is shown
+        self.session = DetectorSession(r'yolov4.weights', r'yolov4.cfg', r"coco.names",
+                                       backend=self.backend.get(), input_size=self.input_size.get()).load_async()
 
         self.create_widgets()
+        self.check_model()
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.root.mainloop()
 
@@ -34,53 +42,56 @@ class TrafficControlApp:
         ttk.Label(frame, text="Max Vehicle Limit:").grid(row=2, column=0, sticky=tk.W)
         ttk.Entry(frame, textvariable=self.max_vehicle_limit).grid(row=2, column=1)
 
-        ttk.Checkbutton(frame, text="Record Screen", variable=self.record_screen).grid(row=3, columnspan=2)
+        ttk.Label(frame, text="DNN Backend:").grid(row=3, column=0, sticky=tk.W)
+        ttk.Combobox(frame, textvariable=self.backend, values=list(BACKENDS), state="readonly").grid(row=3, column=1)
+
+        ttk.Label(frame, text="Input Size:").grid(row=4, column=0, sticky=tk.W)
+        ttk.Entry(frame, textvariable=self.input_size).grid(row=4, column=1)
 
-        ttk.Button(frame, text="Start", command=self.start_processing).grid(row=4, columnspan=2)
+        ttk.Checkbutton(frame, text="Record Screen", variable=self.record_screen).grid(row=5, columnspan=2)
+
+        ttk.Button(frame, text="Start", command=self.start_processing).grid(row=6, columnspan=2)
 
         self.status_label = ttk.Label(frame, text="", foreground="red")
-        self.status_label.grid(row=5, columnspan=2, sticky=tk.W)
+        self.status_label.grid(row=7, columnspan=2, sticky=tk.W)
+
+    def check_model(self):
+        # Poll the background model load and show its state
+        if not self.session.ready:
+            self.status_label.config(text="Loading model...", foreground="orange")
+            self.root.after(200, self.check_model)
+        elif self.status_label.cget("text") == "Loading model...":
+            try:
+                self.session.wait()
+                self.status_label.config(text="Model loaded in {:.1f} s (warm-up {:.2f} s)".format(
+                    self.session.load_seconds, self.session.warmup_seconds), foreground="green")
+            except Exception as error:
+                self.status_label.config(text="Model failed to load: {}".format(error), foreground="red")
 
     def start_processing(self):
         try:
             yellow = self.yellow_threshold.get()
             red = self.red_threshold.get()
             max_limit = self.max_vehicle_limit.get()
+            input_size = self.input_size.get()
 
-            if yellow < red < max_limit:
+            if input_size <= 0 or input_size % 32:
+                messagebox.showerror("Invalid Input", "Input size must be a positive multiple of 32.")
+            elif yellow < red < max_limit:
                 self.status_label.config(text="Processing started...", foreground="green")
+                self.start_time = time.perf_counter()
                 self.process_video()
             else:
                 messagebox.showerror("Invalid Input", "Ensure: Yellow < Red < Max vehicle limit.")
         except tk.TclError:
             messagebox.showerror("Invalid Input", "Please enter valid numbers for all thresholds.")
+        except (cv2.error, OSError) as error:
+            messagebox.showerror("Model Error", str(error))
 
     def on_closing(self):
         self.root.quit()
         self.root.destroy()
 
-    def read_ground_truth(self, file_path):
-        ground_truth = {}
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                frame_number = int(row['frame_number'])
-                count = int(row['true_count'])
-                ground_truth[frame_number] = count
-        return ground_truth
-
-    def calculate_metrics(self, predictions, ground_truth):
-        y_true = [ground_truth.get(i, 0) for i in range(1, len(predictions) + 1)]
-        y_pred = [predictions.get(i, 0) for i in range(1, len(predictions) + 1)]
-
-        print("y_true:", y_true)  # Debug print
-        print("y_pred:", y_pred)  # Debug print
-
-        precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-        recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-        f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-        return precision, recall, f1
-
     def process_video(self):
         # Create folders if they don't exist
         if not os.path.exists("recorded_videos"):
@@ -88,26 +99,31 @@ class TrafficControlApp:
         if not os.path.exists("logs"):
             os.makedirs("logs")
 
-        # Create log file and write the header if it doesn't exist
+        # Emergency log rows are buffered and appended in batches (header written if the file is new)
         log_file_path = os.path.join("logs", "emergency_logs.csv")
-        if not os.path.exists(log_file_path):
-            with open(log_file_path, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Timestamp", "Vehicle Count"])
-
-        # Load YOLO model
-        weights_path = r'yolov4.weights'
-        cfg_path = r'yolov4.cfg'
-        names_path = r"coco.names"
-
-        net = cv2.dnn.readNet(weights_path, cfg_path)
-        with open(names_path, 'r') as f:
-            classes = f.read().strip().split('\n')
+        emergency_log = BufferedCsvWriter(log_file_path, ["Timestamp", "Vehicle Count"], flush_interval=5.0)
+
+        # One alert per congestion episode: it starts above the max vehicle limit and ends at or
+        # below the red threshold; alerts are at least alert_interval seconds apart
+        alert_interval = 30
+        congestion = CongestionMonitor(self.max_vehicle_limit.get(), clear_limit=self.red_threshold.get(),
+                                       min_interval=alert_interval)
+        alerts = AlertDispatcher([
+            lambda alert: emergency_log.write([alert['timestamp'], alert['vehicle_count']]),
+            lambda alert: print("Emergency: vehicle limit exceeded with", alert['vehicle_count'], "vehicles"),
+        ])
+
+        # Reuse the loaded YOLO model, waiting for the background load if it is still running
+        session = self.session.wait().configure(self.backend.get(), self.input_size.get())
+        classes = session.classes
 
         cap = cv2.VideoCapture(r"cars_-_1900 (720p).mp4")
 
         conf_threshold = 0.5
         nms_threshold = 0.4
+        # classes counted as vehicles, any of traffic_detection.VEHICLE_CLASSES ('car', 'motorbike', 'bus', 'truck')
+        vehicle_classes = ('car',)
+        vehicle_ids = class_ids(classes, vehicle_classes)
         desired_fps = 30
         delay = int(1000 / desired_fps)
 
@@ -121,58 +137,39 @@ class TrafficControlApp:
         default_timer = 30
         current_timer = default_timer
 
-        # Set up video writer if recording is enabled
+        # Frames are encoded by a background recorder if recording is enabled. 'block' records every
+        # frame (the loop waits when record_queue frames are pending), 'drop' never waits and counts
+        # the frames it had to skip; record_scale / record_fps reduce the recorded size and rate and
+        # the recording is split into files of record_segment_seconds each
+        recorder = None
         if self.record_screen.get():
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out = cv2.VideoWriter('recorded_videos/output.avi', fourcc, desired_fps, (int(cap.get(3)), int(cap.get(4))))
+            record_policy = 'block'
+            record_queue = 32
+            record_scale = 1.0
+            record_fps = desired_fps
+            record_segment_seconds = 300
+            recorder = VideoRecorder("recorded_videos", desired_fps, (int(cap.get(3)), int(cap.get(4))), fourcc='XVID',
+                                     record_fps=record_fps, scale=record_scale, segment_seconds=record_segment_seconds,
+                                     maxsize=record_queue, policy=record_policy)
 
         # Load ground truth data
-        ground_truth = self.read_ground_truth('ground_truth.csv')
-        predictions = {}
+        ground_truth = read_ground_truth('ground_truth.csv')
+        metrics = CountMetrics()
 
         def process_frame(frame, frame_number):
-            blob = cv2.dnn.blobFromImage(frame, 1 / 255.0, (416, 416), swapRB=True, crop=False)
-            net.setInput(blob)
-            detections = net.forward(net.getUnconnectedOutLayersNames())
-
-            boxes = []
-            confidences = []
-            for detection in detections:
-                for object_detection in detection:
-                    scores = object_detection[5:]
-                    class_id = np.argmax(scores)
-                    confidence = scores[class_id]
-                    if confidence > conf_threshold and class_id == 2:
-                        center_x = int(object_detection[0] * frame.shape[1])
-                        center_y = int(object_detection[1] * frame.shape[0])
-                        w = int(object_detection[2] * frame.shape[1])
-                        h = int(object_detection[3] * frame.shape[0])
-                        x = int(center_x - w / 2)
-                        y = int(center_y - h / 2)
-                        boxes.append([x, y, w, h])
-                        confidences.append(float(confidence))
-
-            indices = cv2.dnn.NMSBoxes(boxes, confidences, conf_threshold, nms_threshold)
-            vehicle_count = len(indices)
-
-            if len(indices) > 0:
-                for i in indices.flatten():
-                    box = boxes[i]
-                    x, y, w, h = box
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-            predictions[frame_number] = vehicle_count
-            return frame, vehicle_count
+            detections = session.forward(frame)
 
-        def show_emergency_popup(vehicle_count):
-            messagebox.showwarning("Emergency", "Vehicle limit exceeded! STOP!")
+            boxes, confidences, _ = decode_outputs(detections, frame.shape, vehicle_ids, conf_threshold, nms_threshold)
+            vehicle_count = len(boxes)
 
-            # Log the vehicle count and timestamp to the CSV file
-            with open(log_file_path, mode='a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), vehicle_count])
+            for x, y, w, h in boxes.tolist():
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+            metrics.update(ground_truth.get(frame_number, 0), vehicle_count)
+            return frame, vehicle_count
 
         frame_number = 1
+        first_frame_time = None
         while True:
             ret, frame = cap.read()
             if not ret:
@@ -182,6 +179,10 @@ class TrafficControlApp:
                 frame, vehicle_count = process_frame(frame, frame_number)
                 cv2.putText(frame, 'Vehicle Count: {}'.format(vehicle_count), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
                             (0, 255, 0), 2)
+                precision, recall, f1 = metrics.scores()
+                cv2.putText(frame, 'P {:.2f} R {:.2f} F1 {:.2f} MAE {:.2f} RMSE {:.2f}'.format(
+                    precision, recall, f1, metrics.mae, metrics.rmse), (10, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                    (0, 255, 0), 2)
 
                 if vehicle_count != prev_vehicle_count:
                     print("Number of vehicles at traffic light:", vehicle_count)
@@ -208,8 +209,8 @@ class TrafficControlApp:
                     last_blink_time = current_time
                     red_light = not red_light
 
-                if vehicle_count > self.max_vehicle_limit.get():
-                    show_emergency_popup(vehicle_count)
+                if congestion.update(vehicle_count):
+                    alerts.post({'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"), 'vehicle_count': vehicle_count})
 
                 frame_number += 1
 
@@ -227,11 +228,23 @@ class TrafficControlApp:
             else:
                 current_timer -= 1
 
+            # Non-modal emergency indicator for the whole congestion episode
+            if congestion.active:
+                cv2.rectangle(frame, (0, 40), (frame.shape[1], 80), (0, 0, 255), -1)
+                cv2.putText(frame, 'EMERGENCY: Vehicle limit exceeded! STOP!', (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                            (255, 255, 255), 2)
+
             cv2.imshow('Traffic Video', frame)
+            if first_frame_time is None:
+                first_frame_time = time.perf_counter()
+                print("First frame shown {:.0f} ms after Start, {:.1f} s after launch (model loaded in {:.1f} s, "
+                      "warm-up {:.0f} ms)".format(1000 * (first_frame_time - self.start_time),
+                                                  first_frame_time - session.created, session.load_seconds,
+                                                  1000 * session.warmup_seconds))
 
-            # Write the frame to the video file if recording is enabled
-            if self.record_screen.get():
-                out.write(frame)
+            # Hand the frame to the recorder if recording is enabled
+            if recorder is not None:
+                recorder.write(frame)
 
             key = cv2.waitKey(delay) & 0xFF
             if key == ord('q'):
@@ -240,17 +253,27 @@ class TrafficControlApp:
                 paused = not paused
 
         cap.release()
-        if self.record_screen.get():
-            out.release()
         cv2.destroyAllWindows()
-
-        # Calculate and print accuracy metrics
-        precision, recall, f1 = self.calculate_metrics(predictions, ground_truth)
+        if recorder is not None:
+            recorder.close()
+            print("Recorded {} frames in {} file(s), {} dropped: {}".format(recorder.frames_written, len(recorder.segments),
+                                                                      recorder.dropped, ', '.join(recorder.segments)))
+        alerts.close()
+        emergency_log.close()
+        print("Congestion episodes: {}, alerts suppressed by rate limit: {}".format(congestion.episodes,
+                                                                                 congestion.suppressed))
+
+        # Print the accuracy metrics accumulated over the run
+        precision, recall, f1 = metrics.scores()
         print(f"Precision: {precision:.2f}")
         print(f"Recall: {recall:.2f}")
         print(f"F1 Score: {f1:.2f}")
+        print(f"Count MAE: {metrics.mae:.2f}")
+        print(f"Count RMSE: {metrics.rmse:.2f}")
 
-        self.on_closing()  # Close the tkinter window when the video processing ends
+        # Keep the form (and the loaded model) for another run
+        self.status_label.config(text="Finished in {:.1f} s. Press Start to run again.".format(
+            time.perf_counter() - self.start_time), foreground="green")
 
 
 if __name__ == "__main__":
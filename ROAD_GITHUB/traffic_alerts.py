@@ -0,0 +1,148 @@
+"""
+Emergency alerts for the traffic control app.
+
+CongestionMonitor turns per-frame vehicle counts into congestion episodes: an episode starts
+when the count exceeds the limit and only ends once it falls back to the clear level
+(hysteresis), and at most one alert is raised per episode and per min_interval seconds.
+Alerts are handed to an AlertDispatcher, whose background thread runs the handlers (e.g.
+logging with a BufferedCsvWriter) so the video loop never waits on them. BufferedCsvWriter
+collects rows in memory and appends them to the CSV file in batches, every flush_interval
+seconds, when max_rows are waiting, and at close.
+"""
+import csv
+import os
+import queue
+import threading
+import time
+
+
+class CongestionMonitor:
+    """
+    Hysteresis and rate limiting of vehicle limit alerts.
+    """
+
+    def __init__(self, limit, clear_limit=None, min_interval=30.0, clock=time.monotonic):
+        """
+        An episode starts when the count exceeds limit and ends when it drops to clear_limit
+        (default limit) or below; alerts are at least min_interval seconds apart.
+        """
+        self.limit = limit
+        self.clear_limit = limit if clear_limit is None else min(clear_limit, limit)
+        self.min_interval = min_interval
+        self.clock = clock
+        self.active = False
+        self.episodes = 0
+        self.suppressed = 0
+        self._last_alert = None
+
+    def update(self, count):
+        """
+        Feeds one frame's count and returns True when an alert should be raised for it.
+        """
+        if self.active:
+            if count <= self.clear_limit:
+                self.active = False
+            return False
+        if count <= self.limit:
+            return False
+        self.active = True
+        self.episodes += 1
+        now = self.clock()
+        if self._last_alert is not None and now - self._last_alert < self.min_interval:
+            self.suppressed += 1
+            return False
+        self._last_alert = now
+        return True
+
+
+class AlertDispatcher:
+    """
+    Runs alert handlers in a background thread.
+    """
+
+    def __init__(self, handlers, maxsize=64):
+        """
+        handlers are callables taking one alert; alerts posted while maxsize are waiting are
+        dropped (and counted) rather than blocking the caller.
+        """
+        self.handlers = list(handlers)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    def post(self, alert):
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            if alert is None:
+                break
+            for handler in self.handlers:
+                try:
+                    handler(alert)
+                except Exception as error:
+                    print("Alert handler failed:", error)
+
+    def close(self):
+        """
+        Runs the handlers for the alerts still waiting and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+
+class BufferedCsvWriter:
+    """
+    Appends rows to a CSV file in batches from a background thread.
+    """
+
+    def __init__(self, path, header=None, flush_interval=5.0, max_rows=100):
+        """
+        header is written first when the file does not exist yet.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.rows_written = 0
+        self._rows = []
+        self._closed = False
+        self._cond = threading.Condition()
+        if header is not None and not os.path.exists(path):
+            with open(path, mode='w', newline='') as file:
+                csv.writer(file).writerow(header)
+        self._thread = threading.Thread(target=self._run, name='csv-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        with self._cond:
+            self._rows.append(row)
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._rows) < self.max_rows:
+                    self._cond.wait(self.flush_interval)
+                rows, self._rows = self._rows, []
+                closed = self._closed
+            if rows:
+                with open(self.path, mode='a', newline='') as file:
+                    csv.writer(file).writerows(rows)
+                self.rows_written += len(rows)
+            if closed:
+                break
+
+    def close(self):
+        """
+        Writes the remaining rows and stops the thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
@@ -0,0 +1,193 @@
+"""
+YOLO (Darknet / cv2.dnn) detection helpers for the traffic control app.
+
+The raw outputs of net.forward are decoded for all candidate rows at once: the output layers
+are concatenated into one array, rows are filtered with boolean masks on class score and
+vehicle class, boxes are converted to pixel [x, y, w, h] together, and only the survivors go
+to cv2.dnn.NMSBoxes.
+
+DetectorSession loads the network and class names once (optionally in a background thread),
+applies the selected DNN backend/target and input size, and runs a warm-up pass so the first
+real frame does not pay the initialisation cost; the app keeps one session across runs.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+VEHICLE_CLASSES = ('car', 'motorbike', 'bus', 'truck')
+
+# name: (cv2.dnn backend, cv2.dnn target)
+BACKENDS = {
+    'default': (cv2.dnn.DNN_BACKEND_DEFAULT, cv2.dnn.DNN_TARGET_CPU),
+    'opencv': (cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU),
+    'opencl': (cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_OPENCL),
+    'opencl_fp16': (cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_OPENCL_FP16),
+    'openvino': (cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE, cv2.dnn.DNN_TARGET_CPU),
+    'cuda': (cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA),
+    'cuda_fp16': (cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA_FP16),
+}
+
+
+class DetectorSession:
+    """
+    A cv2.dnn network with its class names, loaded once and reused for every run.
+    """
+
+    def __init__(self, weights_path, cfg_path, names_path, backend='default', input_size=416, warmup=1):
+        """
+        backend is a key of BACKENDS, input_size the square network input (a multiple of 32),
+        warmup the number of forward passes run after loading.
+        """
+        if backend not in BACKENDS:
+            raise ValueError("backend must be one of %s, got %r" % (', '.join(BACKENDS), backend))
+        self.weights_path = weights_path
+        self.cfg_path = cfg_path
+        self.names_path = names_path
+        self.backend = backend
+        self.input_size = input_size
+        self.warmup = warmup
+        self.net = None
+        self.classes = None
+        self.output_names = None
+        self.created = time.perf_counter()
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._ready = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def load(self):
+        """
+        Reads the network and class names, applies the backend and warms up. Does nothing when
+        already loaded.
+        """
+        with self._lock:
+            if self.net is not None:
+                return self
+            try:
+                start = time.perf_counter()
+                net = cv2.dnn.readNet(self.weights_path, self.cfg_path)
+                with open(self.names_path, 'r') as f:
+                    self.classes = f.read().strip().split('\n')
+                self.output_names = net.getUnconnectedOutLayersNames()
+                self.net = net
+                self.load_seconds = time.perf_counter() - start
+                self._configure()
+            except Exception as error:
+                self._error = error
+            finally:
+                self._ready.set()
+        return self
+
+    def load_async(self):
+        """
+        Starts load in a daemon thread and returns immediately; wait() blocks until it is done.
+        """
+        threading.Thread(target=self.load, name='model-loader', daemon=True).start()
+        return self
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the session is loaded and returns it, re-raising any loading error.
+        """
+        if not self._ready.wait(timeout):
+            raise TimeoutError("model not loaded after %s seconds" % timeout)
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def configure(self, backend=None, input_size=None):
+        """
+        Switches backend and/or input size of the loaded network (without re-reading the
+        weights) and warms up again if anything changed.
+        """
+        self.wait()
+        with self._lock:
+            if (backend or self.backend, input_size or self.input_size) == (self.backend, self.input_size):
+                return self
+            if backend is not None and backend not in BACKENDS:
+                raise ValueError("backend must be one of %s, got %r" % (', '.join(BACKENDS), backend))
+            self.backend = backend or self.backend
+            self.input_size = input_size or self.input_size
+            self._configure()
+        return self
+
+    def _configure(self):
+        self.net.setPreferableBackend(BACKENDS[self.backend][0])
+        self.net.setPreferableTarget(BACKENDS[self.backend][1])
+        start = time.perf_counter()
+        blank = np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8)
+        for _ in range(self.warmup):
+            self._forward(blank)
+        self.warmup_seconds = time.perf_counter() - start
+
+    def _forward(self, frame):
+        blob = cv2.dnn.blobFromImage(frame, 1 / 255.0, (self.input_size, self.input_size), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        return self.net.forward(self.output_names)
+
+    def forward(self, frame):
+        """
+        Returns the raw output layers of the network for one BGR frame, see decode_outputs.
+        """
+        with self._lock:
+            return self._forward(frame)
+
+
+def class_ids(classes, names):
+    """
+    Returns the sorted class IDs of the given class names (e.g. VEHICLE_CLASSES) in classes.
+    """
+    missing = [name for name in names if name not in classes]
+    if missing:
+        raise ValueError("unknown classes: %s" % ', '.join(missing))
+    return np.array(sorted(classes.index(name) for name in names))
+
+
+def candidate_boxes(outputs, frame_shape, vehicle_ids, conf_threshold=0.5):
+    """
+    Returns the pre-NMS candidates of the outputs of net.forward for one frame.
+
+    outputs is the list of output layer arrays (rows of [cx, cy, w, h, objectness, class
+    scores...] relative to the frame), frame_shape the frame's (height, width, ...) and
+    vehicle_ids the class IDs to keep. A row is kept when its best class is in vehicle_ids and
+    that class score exceeds conf_threshold.
+    Returns (boxes N x 4 int [x, y, w, h], confidences N, class IDs N).
+    """
+    rows = np.concatenate([np.asarray(output).reshape(-1, output.shape[-1]) for output in outputs])
+    scores = rows[:, 5:]
+    best = scores.argmax(axis=1)
+    confidence = scores[np.arange(len(rows)), best]
+    keep = (confidence > conf_threshold) & np.isin(best, vehicle_ids)
+    rows, confidence, best = rows[keep], confidence[keep], best[keep]
+
+    # same truncation as int() on each value
+    height, width = frame_shape[:2]
+    center = (rows[:, :2] * (width, height)).astype(int)
+    size = (rows[:, 2:4] * (width, height)).astype(int)
+    return np.column_stack(((center - size / 2).astype(int), size)), confidence, best
+
+
+def suppress(boxes, confidences, class_ids, conf_threshold=0.5, nms_threshold=0.4):
+    """
+    Runs cv2.dnn.NMSBoxes over candidates and returns the kept (boxes, confidences, class IDs).
+    """
+    indices = cv2.dnn.NMSBoxes(np.asarray(boxes).tolist(), np.asarray(confidences, dtype=float).tolist(),
+                               conf_threshold, nms_threshold)
+    indices = np.array(indices, dtype=int).reshape(-1)
+    return boxes[indices], confidences[indices], class_ids[indices]
+
+
+def decode_outputs(outputs, frame_shape, vehicle_ids, conf_threshold=0.5, nms_threshold=0.4):
+    """
+    Decodes the outputs of net.forward for one frame: candidate_boxes followed by suppress.
+    Returns (boxes N x 4 int [x, y, w, h], confidences N, class IDs N).
+    """
+    boxes, confidences, best = candidate_boxes(outputs, frame_shape, vehicle_ids, conf_threshold)
+    return suppress(boxes, confidences, best, conf_threshold, nms_threshold)
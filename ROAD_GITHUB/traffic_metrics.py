@@ -0,0 +1,96 @@
+"""
+Streaming accuracy metrics of per-frame vehicle counts.
+
+Each frame's (true count, predicted count) pair adds one to a confusion matrix indexed by count,
+so memory does not grow with the video length and an update is O(1). Precision, recall and F1
+are the macro averages over every count that occurred as a true or predicted value, with 0 for
+undefined ratios, i.e. the same numbers as sklearn's precision_score / recall_score / f1_score
+with average='macro' and zero_division=0 on the full lists. The mean absolute and root mean
+squared count errors are kept alongside.
+"""
+import csv
+
+import numpy as np
+
+
+def read_ground_truth(file_path):
+    """
+    Reads {frame_number: true_count} from a CSV with frame_number and true_count columns.
+    """
+    ground_truth = {}
+    with open(file_path, 'r') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            ground_truth[int(row['frame_number'])] = int(row['true_count'])
+    return ground_truth
+
+
+class CountMetrics:
+    """
+    Confusion matrix of true vs predicted counts, updated one frame at a time.
+    """
+
+    def __init__(self, max_count=64):
+        """
+        max_count is the initial largest count held; the matrix doubles when a larger one occurs.
+        """
+        self.confusion = np.zeros((max_count + 1, max_count + 1), dtype=np.int64)
+        self.frames = 0
+        self.abs_error = 0
+        self.sq_error = 0
+        self._size = 0
+
+    def _fit(self, largest):
+        while largest >= len(self.confusion):
+            grown = np.zeros((2 * len(self.confusion),) * 2, dtype=np.int64)
+            grown[:len(self.confusion), :len(self.confusion)] = self.confusion
+            self.confusion = grown
+        self._size = max(self._size, largest + 1)
+
+    def update(self, true_count, predicted_count):
+        true_count, predicted_count = int(true_count), int(predicted_count)
+        self._fit(max(true_count, predicted_count))
+        self.confusion[true_count, predicted_count] += 1
+        self.frames += 1
+        error = predicted_count - true_count
+        self.abs_error += abs(error)
+        self.sq_error += error * error
+
+    def update_many(self, true_counts, predicted_counts):
+        """
+        Adds many frames at once from two equally long arrays of counts.
+        """
+        true_counts = np.asarray(true_counts, dtype=np.int64)
+        predicted_counts = np.asarray(predicted_counts, dtype=np.int64)
+        if len(true_counts) == 0:
+            return
+        self._fit(int(max(true_counts.max(), predicted_counts.max())))
+        np.add.at(self.confusion, (true_counts, predicted_counts), 1)
+        self.frames += len(true_counts)
+        error = predicted_counts - true_counts
+        self.abs_error += int(np.abs(error).sum())
+        self.sq_error += int((error * error).sum())
+
+    def scores(self):
+        """
+        Returns macro (precision, recall, f1) over the counts seen so far.
+        """
+        confusion = self.confusion[:self._size, :self._size]
+        tp = np.diag(confusion).astype(float)
+        predicted = confusion.sum(axis=0)
+        actual = confusion.sum(axis=1)
+        labels = (predicted > 0) | (actual > 0)
+        if not labels.any():
+            return 0.0, 0.0, 0.0
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        recall = np.divide(tp, actual, out=np.zeros_like(tp), where=actual > 0)
+        f1 = np.divide(2 * tp, predicted + actual, out=np.zeros_like(tp), where=predicted + actual > 0)
+        return precision[labels].mean(), recall[labels].mean(), f1[labels].mean()
+
+    @property
+    def mae(self):
+        return self.abs_error / self.frames if self.frames else 0.0
+
+    @property
+    def rmse(self):
+        return (self.sq_error / self.frames) ** 0.5 if self.frames else 0.0
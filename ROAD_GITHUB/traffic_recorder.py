@@ -0,0 +1,98 @@
+"""
+Background video recording for the traffic control app.
+
+VideoRecorder takes annotated frames from the video loop through a bounded queue and encodes
+them in its own thread, so the loop only pays for a queue put. When the queue is full the loop
+either waits ('block', every frame is recorded) or the frame is dropped and counted ('drop',
+the loop never waits). Frames can be recorded at a lower frame rate and resolution, and the
+recording is split into segment files of segment_seconds each, so a crash only loses the
+segment being written.
+"""
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+POLICIES = ('block', 'drop')
+
+
+class VideoRecorder:
+    """
+    Encodes frames to segmented video files in a background thread.
+    """
+
+    def __init__(self, directory, fps, frame_size, fourcc='XVID', extension='.avi', record_fps=None, scale=1.0,
+                 segment_seconds=300, maxsize=32, policy='block', prefix=None):
+        """
+        fps and frame_size (width, height) describe the frames passed to write; record_fps
+        (default fps) and scale set the recorded rate and size. Segments are named
+        <prefix>_000<extension>, ... in directory, prefix defaulting to output_<date>_<time>.
+        """
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s, got %r" % (', '.join(POLICIES), policy))
+        self.directory = directory
+        self.fps = float(fps)
+        self.record_fps = min(float(record_fps or fps), self.fps)
+        self.size = (int(frame_size[0] * scale), int(frame_size[1] * scale))
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.extension = extension
+        self.segment_frames = max(1, int(round(segment_seconds * self.record_fps)))
+        self.policy = policy
+        self.prefix = prefix or time.strftime("output_%Y%m%d_%H%M%S")
+        self.frames_written = 0
+        self.dropped = 0
+        self.segments = []
+        self._skip = 0.0
+        self._writer = None
+        self._queue = queue.Queue(maxsize)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._thread = threading.Thread(target=self._run, name='video-recorder', daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        """
+        Queues a frame for recording (or skips it to reach record_fps). The frame must not be
+        modified afterwards.
+        """
+        self._skip += self.record_fps / self.fps
+        if self._skip < 1.0:
+            return
+        self._skip -= 1.0
+        if self.policy == 'block':
+            self._queue.put(frame)
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def _open_segment(self):
+        if self._writer is not None:
+            self._writer.release()
+        path = os.path.join(self.directory, '%s_%03d%s' % (self.prefix, len(self.segments), self.extension))
+        self._writer = cv2.VideoWriter(path, self.fourcc, self.record_fps, self.size)
+        self.segments.append(path)
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self.frames_written % self.segment_frames == 0:
+                self._open_segment()
+            if (frame.shape[1], frame.shape[0]) != self.size:
+                frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+            self._writer.write(frame)
+            self.frames_written += 1
+        if self._writer is not None:
+            self._writer.release()
+
+    def close(self):
+        """
+        Encodes the frames still queued, closes the current segment and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,223 @@
+"""
+Parameter sweeps for the traffic control app from cached detections.
+
+The network runs once per video: every frame's pre-NMS vehicle candidates (boxes, scores and
+classes above a low min_conf) are stored in a compressed .npz cache named after the video and a
+fingerprint of the video, model files, DNN backend, input size, vehicle classes and min_conf, so
+a changed video or model never reuses a stale cache. A sweep then re-applies conf_threshold and NMS to
+the cached candidates for every (conf, nms) pair in a process pool, and evaluates the count
+metrics, the yellow/red light decisions and the emergency episodes of every (yellow, red, max)
+setting with array operations over all frames:
+
+    $ python traffic_sweep.py "cars_-_1900 (720p).mp4" --conf 0.3:0.7:0.05 --nms 0.3,0.4,0.5 \\
+          --yellow 2:6 --red 4:10 --max 6:14:2 --workers 4 --output sweep_results.csv
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import os
+import time
+
+import cv2
+import numpy as np
+
+from traffic_detection import BACKENDS, DetectorSession, candidate_boxes, class_ids, suppress
+from traffic_metrics import CountMetrics, read_ground_truth
+
+COLUMNS = ['conf_threshold', 'nms_threshold', 'yellow_threshold', 'red_threshold', 'max_vehicle_limit',
+           'precision', 'recall', 'f1', 'mae', 'rmse', 'light_agreement', 'episodes', 'true_episodes']
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, int(stat.st_mtime)
+
+
+def cache_key(video_path, session, vehicle_names, min_conf):
+    """
+    Returns a fingerprint of everything the cached candidates depend on.
+    """
+    digest = hashlib.sha1()
+    cfg = ''
+    if session.cfg_path:
+        with open(session.cfg_path, 'rb') as f:
+            cfg = hashlib.sha1(f.read()).hexdigest()
+    for part in (os.path.abspath(video_path), _stat(video_path), _stat(session.weights_path), cfg,
+                 _stat(session.names_path), session.backend, session.input_size, sorted(vehicle_names), min_conf):
+        digest.update(repr(part).encode())
+    return digest.hexdigest()[:16]
+
+
+def build_cache(session, video_path, cache_dir='cache', vehicle_names=('car',), min_conf=0.1):
+    """
+    Runs the network once over the video and stores each frame's candidates (see candidate_boxes)
+    with score above min_conf. An existing cache with the same fingerprint is reused, otherwise
+    the session is loaded if it is not yet. Returns the cache path.
+    """
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    path = os.path.join(cache_dir, '%s_%s.npz' % (stem, cache_key(video_path, session, vehicle_names, min_conf)))
+    if os.path.exists(path):
+        return path
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    vehicle_ids = class_ids(session.load().wait().classes, vehicle_names)
+    boxes, confidences, classes, counts = [], [], [], []
+    cap = cv2.VideoCapture(video_path)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_boxes, frame_conf, frame_cls = candidate_boxes(session.forward(frame), frame.shape, vehicle_ids, min_conf)
+        boxes.append(frame_boxes)
+        confidences.append(frame_conf)
+        classes.append(frame_cls)
+        counts.append(len(frame_boxes))
+    cap.release()
+    tmp = path[:-len('.npz')] + '.tmp.npz'
+    np.savez_compressed(tmp, boxes=np.concatenate(boxes).reshape(-1, 4).astype(np.int32) if boxes else np.empty((0, 4), np.int32),
+                        conf=np.concatenate(confidences).astype(np.float32) if confidences else np.empty(0, np.float32),
+                        cls=np.concatenate(classes).astype(np.int16) if classes else np.empty(0, np.int16),
+                        offsets=np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+                        min_conf=np.array(min_conf))
+    os.replace(tmp, path)
+    return path
+
+
+def frame_counts(boxes, conf, cls, offsets, conf_threshold, nms_threshold):
+    """
+    Returns the vehicle count of every frame after applying conf_threshold and NMS to the cached
+    candidates, the same counts a live run with these thresholds produces.
+    """
+    counts = np.zeros(len(offsets) - 1, dtype=np.int64)
+    keep = conf > conf_threshold
+    starts, ends = offsets[:-1], offsets[1:]
+    kept = np.concatenate(([0], np.cumsum(keep)))
+    # only frames with a candidate left need NMS
+    for f in np.flatnonzero(kept[ends] > kept[starts]):
+        s = slice(starts[f], ends[f])
+        k = keep[s]
+        counts[f] = len(suppress(boxes[s][k], conf[s][k], cls[s][k], conf_threshold, nms_threshold)[0])
+    return counts
+
+
+def light_states(counts, yellow, red):
+    """
+    Returns the light of each frame as in the app: 2 (red) at or above red, else 1 (yellow) at
+    or below yellow, else 0.
+    """
+    return np.where(counts >= red, 2, np.where(counts <= yellow, 1, 0))
+
+
+def congestion_episodes(counts, limit, clear_limit):
+    """
+    Returns the number of congestion episodes (see traffic_alerts.CongestionMonitor) in counts:
+    an episode starts above limit and lasts until the count is at or below clear_limit.
+    """
+    events = np.where(counts > limit, 1, np.where(counts <= min(clear_limit, limit), 0, -1))
+    last = np.maximum.accumulate(np.where(events >= 0, np.arange(len(events)), -1))
+    state = np.where(last >= 0, events[np.maximum(last, 0)], 0)
+    return int(np.count_nonzero(np.diff(state, prepend=0) == 1))
+
+
+_sweep = {}
+
+
+def _init_sweep(cache_path, true_counts):
+    with np.load(cache_path) as data:
+        _sweep.update((name, data[name]) for name in ('boxes', 'conf', 'cls', 'offsets'))
+    _sweep['true'] = true_counts
+
+
+def _sweep_job(job):
+    conf_threshold, nms_threshold, thresholds = job
+    counts = frame_counts(_sweep['boxes'], _sweep['conf'], _sweep['cls'], _sweep['offsets'], conf_threshold, nms_threshold)
+    true = _sweep['true']
+    metrics = CountMetrics()
+    metrics.update_many(true, counts)
+    precision, recall, f1 = metrics.scores()
+    rows = []
+    for yellow, red, max_limit in thresholds:
+        agreement = float(np.mean(light_states(counts, yellow, red) == light_states(true, yellow, red))) if len(true) else 0.0
+        rows.append([conf_threshold, nms_threshold, yellow, red, max_limit, precision, recall, f1, metrics.mae,
+                     metrics.rmse, agreement, congestion_episodes(counts, max_limit, red),
+                     congestion_episodes(true, max_limit, red)])
+    return rows
+
+
+def sweep(cache_path, ground_truth, conf_values, nms_values, yellow_values, red_values, max_values, workers=1):
+    """
+    Evaluates every valid combination (yellow < red < max) and returns rows of COLUMNS.
+    """
+    with np.load(cache_path) as data:
+        frames = len(data['offsets']) - 1
+        min_conf = float(data['min_conf'])
+    if min(conf_values) < min_conf:
+        raise ValueError("conf thresholds below the cached min_conf %.2f need a new cache" % min_conf)
+    true = np.array([ground_truth.get(i, 0) for i in range(1, frames + 1)], dtype=np.int64)
+    thresholds = [(y, r, m) for y, r, m in itertools.product(yellow_values, red_values, max_values) if y < r < m]
+    jobs = [(c, n, thresholds) for c, n in itertools.product(conf_values, nms_values)]
+    if workers <= 1:
+        _init_sweep(cache_path, true)
+        results = [_sweep_job(job) for job in jobs]
+    else:
+        from multiprocessing import Pool
+        with Pool(workers, initializer=_init_sweep, initargs=(cache_path, true)) as pool:
+            results = pool.map(_sweep_job, jobs, chunksize=1)
+    return [row for rows in results for row in rows]
+
+
+def parse_values(text, kind=float):
+    """
+    Parses 'a,b,c' or an inclusive range 'start:stop[:step]' (step 1 by default).
+    """
+    if ':' in text:
+        parts = [kind(v) for v in text.split(':')]
+        start, stop, step = parts[0], parts[1], parts[2] if len(parts) > 2 else kind(1)
+        return [kind(round(v, 6)) for v in np.arange(start, stop + step / 2., step)]
+    return [kind(v) for v in text.split(',')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Traffic control parameter sweep from cached detections')
+    parser.add_argument("video", help="Video to evaluate.")
+    parser.add_argument("--weights", default='yolov4.weights')
+    parser.add_argument("--cfg", default='yolov4.cfg')
+    parser.add_argument("--names", default='coco.names')
+    parser.add_argument("--backend", default='default', choices=list(BACKENDS))
+    parser.add_argument("--input_size", type=int, default=416)
+    parser.add_argument("--classes", default='car', help="Comma separated vehicle classes.")
+    parser.add_argument("--ground_truth", default='ground_truth.csv')
+    parser.add_argument("--cache_dir", default='cache')
+    parser.add_argument("--min_conf", type=float, default=0.1, help="Lowest score kept in the cache.")
+    parser.add_argument("--conf", default='0.5', help="conf_threshold values, 'a,b' or 'start:stop:step'.")
+    parser.add_argument("--nms", default='0.4', help="nms_threshold values.")
+    parser.add_argument("--yellow", default='0:10', help="yellow_threshold values.")
+    parser.add_argument("--red", default='1:15', help="red_threshold values.")
+    parser.add_argument("--max", default='2:20', help="max_vehicle_limit values.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default='sweep_results.csv')
+    parser.add_argument("--top", type=int, default=10, help="Best settings to print.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    vehicle_names = args.classes.split(',')
+    start = time.perf_counter()
+    session = DetectorSession(args.weights, args.cfg, args.names, backend=args.backend, input_size=args.input_size)
+    cache_path = build_cache(session, args.video, args.cache_dir, vehicle_names, args.min_conf)
+    print("Detections cached in {} ({:.1f} s)".format(cache_path, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    rows = sweep(cache_path, read_ground_truth(args.ground_truth), parse_values(args.conf), parse_values(args.nms),
+                 parse_values(args.yellow, int), parse_values(args.red, int), parse_values(args.max, int), args.workers)
+    print("Evaluated {} settings in {:.1f} s".format(len(rows), time.perf_counter() - start))
+
+    with open(args.output, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+    rows.sort(key=lambda row: (row[COLUMNS.index('f1')], row[COLUMNS.index('light_agreement')]), reverse=True)
+    for row in rows[:args.top]:
+        print(', '.join('{}={:.3g}'.format(name, value) for name, value in zip(COLUMNS, row)))